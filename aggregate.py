@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Distance, time and pace statistics for the activities in a GarminStore,
+aggregated over time buckets and grouped by activity type.
+
+Buckets are days ('day'), ISO weeks ('week'), calendar months ('month') and
+years ('year'), or rolling windows of N days ('<N>d', e.g. '28d', keyed by the
+last day of the window).
+
+Aggregates are kept in aggregates.json in the store. Adding, changing or
+removing an activity only updates the buckets that activity belongs to.
+"""
+
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from garmin import Activity, GarminStore
+from policy import FileTypePolicy
+
+# Pace percentiles reported for each bucket.
+Percentiles = (10, 50, 90)
+
+# Group that every activity belongs to, regardless of activity type.
+AllTypes = 'all'
+
+
+def check_kind(kind: str) -> str:
+    """Return kind if it is a valid bucket kind, else raise ValueError."""
+    if kind in ('day', 'week', 'month', 'year'):
+        return kind
+    if kind.endswith('d') and kind[:-1].isdigit() and int(kind[:-1]) > 0:
+        return kind
+    raise ValueError('Unknown bucket kind "{}"'.format(kind))
+
+
+def bucket_keys(kind: str, day: date) -> List[str]:
+    """Return the keys of the buckets of the given kind containing day."""
+    if kind == 'day':
+        return [day.isoformat()]
+    elif kind == 'week':
+        year, week, _ = day.isocalendar()
+        return ['{}-W{:02d}'.format(year, week)]
+    elif kind == 'month':
+        return [day.strftime('%Y-%m')]
+    elif kind == 'year':
+        return [str(day.year)]
+    else:  # Rolling window of N days, keyed by its last day.
+        return [(day + timedelta(days=i)).isoformat()
+                for i in range(int(kind[:-1]))]
+
+
+@dataclass(slots=True, frozen=True)
+class Member:
+    """The parts of an activity that go into the aggregates."""
+
+    type: str
+    day: str  # YYYY-MM-DD
+    distance: float  # meters
+    duration: float  # seconds
+
+    @classmethod
+    def from_activity(cls, act: Activity) -> 'Member':
+        return cls(FileTypePolicy.activity_type(act.json),
+                   act.when.date().isoformat(), act.distance, act.duration)
+
+    @property
+    def pace(self) -> Optional[float]:
+        """Seconds per kilometer, or None if there is no distance."""
+        if self.distance <= 0:
+            return None
+        return self.duration / (self.distance / 1000.0)
+
+
+@dataclass(slots=True)
+class Bucket:
+    count: int = 0
+    distance: float = 0.0  # meters
+    duration: float = 0.0  # seconds
+    paces: List[float] = field(default_factory=list)  # sorted, s/km
+
+    def add(self, member: Member) -> None:
+        self.count += 1
+        self.distance += member.distance
+        self.duration += member.duration
+        if member.pace is not None:
+            insort(self.paces, member.pace)
+
+    def remove(self, member: Member) -> None:
+        self.count -= 1
+        self.distance -= member.distance
+        self.duration -= member.duration
+        if member.pace is not None:
+            del self.paces[bisect_left(self.paces, member.pace)]
+
+    def summary(self) -> Dict[str, Any]:
+        summary = {
+            'count': self.count,
+            'distance': self.distance,
+            'duration': self.duration,
+        }
+        if self.paces:
+            percentiles = np.percentile(self.paces, Percentiles)
+        else:
+            percentiles = [None] * len(Percentiles)
+        for p, pace in zip(Percentiles, percentiles):
+            summary['pace_p{}'.format(p)] = (
+                None if pace is None else float(pace))
+        return summary
+
+
+class Aggregator:
+    """Aggregates of the activities in a GarminStore, kept in the store."""
+
+    Filename = 'aggregates.json'
+
+    def __init__(self, store: GarminStore, kinds: Iterable[str]):
+        self.store = store
+        self.kinds = sorted(set(check_kind(k) for k in kinds))
+        self.members: Dict[str, Member] = {}
+        # kind -> group -> key -> Bucket
+        self.buckets: Dict[str, Dict[str, Dict[str, Bucket]]] = {
+            kind: {} for kind in self.kinds}
+        try:
+            data = json.loads(store.read(self.Filename))
+        except KeyError:
+            return
+        if data.get('kinds') != self.kinds:
+            return  # Different buckets; rebuild from scratch
+        self.members = {
+            key: Member(*m) for key, m in data['members'].items()}
+        self.buckets = {
+            kind: {group: {key: Bucket(*b) for key, b in buckets.items()}
+                   for group, buckets in groups.items()}
+            for kind, groups in data['buckets'].items()}
+
+    def save(self) -> None:
+        data = {
+            'kinds': self.kinds,
+            'members': {
+                key: [m.type, m.day, m.distance, m.duration]
+                for key, m in self.members.items()},
+            'buckets': {
+                kind: {group: {key: [b.count, b.distance, b.duration, b.paces]
+                               for key, b in buckets.items()}
+                       for group, buckets in groups.items()}
+                for kind, groups in self.buckets.items()},
+        }
+        self.store.write(
+            self.Filename, json.dumps(data, sort_keys=True).encode('utf8'))
+
+    def _apply(self, member: Member, add: bool) -> None:
+        day = date.fromisoformat(member.day)
+        for kind in self.kinds:
+            groups = self.buckets[kind]
+            for group in (member.type, AllTypes):
+                buckets = groups.setdefault(group, {})
+                for key in bucket_keys(kind, day):
+                    bucket = buckets.setdefault(key, Bucket())
+                    if add:
+                        bucket.add(member)
+                    else:
+                        bucket.remove(member)
+                        if bucket.count <= 0:
+                            del buckets[key]
+
+    def add(self, act: Activity) -> bool:
+        """Add/update the given activity. Return False if unchanged."""
+        key = str(act.activityId)
+        member = Member.from_activity(act)
+        old = self.members.get(key)
+        if old == member:
+            return False
+        if old is not None:
+            self._apply(old, add=False)
+        self._apply(member, add=True)
+        self.members[key] = member
+        return True
+
+    def remove(self, activity_id) -> bool:
+        """Remove the given activity. Return False if it was not present."""
+        old = self.members.pop(str(activity_id), None)
+        if old is None:
+            return False
+        self._apply(old, add=False)
+        return True
+
+    def update(self) -> int:
+        """Sync with the activities in the store. Return #changes."""
+        changes = 0
+        seen = set()
+        for act in self.store.walk():
+            seen.add(str(act.activityId))
+            changes += self.add(act)
+        for key in set(self.members) - seen:
+            changes += self.remove(key)
+        if changes:
+            self.save()
+        return changes
+
+    def summary(self, kind: str, group: str = AllTypes,
+                until: Optional[date] = None
+                ) -> List[Tuple[str, Dict[str, Any]]]:
+        """Return [(bucket key, summary)] in chronological order.
+
+        Rolling windows are kept for every day an activity falls into, i.e.
+        up to N-1 days after it. Windows ending after the group's last
+        activity, or after until (default: today), are left out."""
+        buckets = self.buckets[check_kind(kind)].get(group, {})
+        keys = sorted(buckets)
+        if keys and kind.endswith('d'):
+            last = date.fromisoformat(keys[-1]) - timedelta(
+                days=int(kind[:-1]) - 1)
+            last = min(last, until or date.today()).isoformat()
+            keys = [key for key in keys if key <= last]
+        return [(key, buckets[key].summary()) for key in keys]
+
+
+def stored_kinds(store: GarminStore) -> List[str]:
+    """Return the bucket kinds kept in the store's aggregates.json."""
+    try:
+        return json.loads(store.read(Aggregator.Filename))['kinds']
+    except KeyError:
+        return []
+
+
+def format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    return '{}:{:02d}'.format(minutes, seconds)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Garmin activity statistics per time period')
+    parser.add_argument(
+        '-d', '--dir', default='.',
+        help='Directory where Garmin activities (.json files) are stored.')
+    parser.add_argument(
+        '-b', '--bucket', action='append', default=[], type=check_kind,
+        help='Bucket kind: day, week, month, year or <N>d for rolling N-day '
+             'windows. May be given multiple times (default: month).')
+    parser.add_argument(
+        '-t', '--type', default=AllTypes, type=lambda s: s.strip().lower(),
+        help='Only show activities of this type, e.g. "running".')
+    parser.add_argument(
+        '-n', '--last', type=int, default=12,
+        help='Show this many of the most recent buckets (default: 12).')
+    args = parser.parse_args()
+
+    # All kinds ever asked for are kept, so that switching between them
+    # does not throw the aggregates away.
+    store = GarminStore(args.dir)
+    requested = args.bucket or ['month']
+    aggregator = Aggregator(store, list(requested) + stored_kinds(store))
+    print('Updated {} activities in {}'.format(aggregator.update(), args.dir))
+
+    for kind in requested:
+        print()
+        print('{:<12} {:>5} {:>9} {:>10} {:>7} {:>7} {:>7}'.format(
+            kind, 'count', 'km', 'time', 'p10', 'p50', 'p90'))
+        for key, s in aggregator.summary(kind, args.type)[-args.last:]:
+            print('{:<12} {:>5} {:>9.1f} {:>10} {:>7} {:>7} {:>7}'.format(
+                key, s['count'], s['distance'] / 1000.0,
+                format_seconds(s['duration']),
+                *(format_seconds(s['pace_p{}'.format(p)])
+                  for p in Percentiles)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Benchmark the hot paths of working with a local GarminStore: walking the
+store (loading every .json summary) and parsing every .tcx file.
+
+A synthetic store is generated in a temporary directory, so the results do
+not depend on anybody's Garmin Connect account. This script deliberately
+stays compatible with Python 2.7, so that an older checkout can be compared
+against the current one, e.g.:
+
+    git worktree add /tmp/old <old commit>
+    cp bench.py /tmp/old/ && python2 /tmp/old/bench.py
+    python3 bench.py --no-shortcuts
+    python3 bench.py
+
+The parser's shortcuts (skipping <Track> contents, stopping early at the
+wrong sport) are an algorithmic change; --no-shortcuts turns them off, so
+that the first two runs above compare the interpreters on the same
+algorithm, and the last two show the effect of the shortcuts.
+"""
+
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from garmin import GarminStore
+import parser as gcparser
+
+TcxHeader = """<?xml version="1.0" encoding="UTF-8" standalone="no" ?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities>
+    <Activity Sport="{sport}">
+      <Id>{when}</Id>
+"""
+
+TcxLap = """      <Lap StartTime="{when}">
+        <TotalTimeSeconds>{seconds}</TotalTimeSeconds>
+        <DistanceMeters>{meters}</DistanceMeters>
+        <Calories>80</Calories>
+        <Intensity>Active</Intensity>
+        <TriggerMethod>Distance</TriggerMethod>
+        <Track>
+{points}        </Track>
+      </Lap>
+"""
+
+TcxPoint = """          <Trackpoint>
+            <Time>{when}</Time>
+            <Position>
+              <LatitudeDegrees>59.9{i:04d}</LatitudeDegrees>
+              <LongitudeDegrees>10.7{i:04d}</LongitudeDegrees>
+            </Position>
+            <AltitudeMeters>{alt}</AltitudeMeters>
+            <DistanceMeters>{meters}</DistanceMeters>
+            <HeartRateBpm><Value>{hr}</Value></HeartRateBpm>
+            <Cadence>{cad}</Cadence>
+          </Trackpoint>
+"""
+
+TcxFooter = """    </Activity>
+  </Activities>
+</TrainingCenterDatabase>
+"""
+
+TimeFormat = '%Y-%m-%dT%H:%M:%S.000Z'
+
+
+def make_tcx(when, sport, laps, points_per_lap):
+    parts = [TcxHeader.format(sport=sport, when=when.strftime(TimeFormat))]
+    meters = 0.0
+    for lap in range(laps):
+        points = []
+        for i in range(points_per_lap):
+            t = when + timedelta(seconds=5 * (lap * points_per_lap + i))
+            meters += 15.0
+            points.append(TcxPoint.format(
+                when=t.strftime(TimeFormat), i=i % 10000, alt=100 + i % 7,
+                meters=meters, hr=140 + i % 20, cad=85 + i % 5))
+        parts.append(TcxLap.format(
+            when=when.strftime(TimeFormat), seconds=5.0 * points_per_lap,
+            meters=15.0 * points_per_lap, points=''.join(points)))
+    parts.append(TcxFooter)
+    return ''.join(parts)
+
+
+def make_json(activity_id, when, sport):
+    return json.dumps({
+        'activityId': activity_id,
+        'activityName': 'Activity {}'.format(activity_id),
+        'activityType': {'key': sport.lower(), 'display': sport},
+        'activitySummary': {
+            'BeginTimestamp': {'value': when.strftime(TimeFormat)},
+            'SumDistance': {'value': '10.0', 'uom': 'kilometer'},
+            'SumDuration': {'value': '3000.0', 'uom': 'second'},
+        },
+    }, sort_keys=True)
+
+
+def generate(where, activities, laps, points_per_lap):
+    start = datetime(2014, 1, 1, 7, 0, 0)
+    for i in range(activities):
+        activity_id = 100000000 + i
+        when = start + timedelta(days=i)
+        sport = 'Biking' if i % 5 == 4 else 'Running'
+        with open(os.path.join(where, '{}.json'.format(activity_id)), 'w') as f:
+            f.write(make_json(activity_id, when, sport))
+        with open(os.path.join(where, '{}.tcx'.format(activity_id)), 'w') as f:
+            f.write(make_tcx(when, sport, laps, points_per_lap))
+
+
+def bench_walk(where):
+    n = 0
+    for act in GarminStore(where).walk(sorted=True):
+        act.when, act.what, act.name
+        n += 1
+    return n
+
+
+def bench_parse(where):
+    n = 0
+    for fname in sorted(os.listdir(where)):
+        if fname.endswith('.tcx'):
+            ts, distances, times = gcparser.GCFileParser(
+                os.path.join(where, fname)).parse()
+            n += ts is not None
+    return n
+
+
+def timed(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        result = func(arg)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark walking and parsing a (synthetic) store.')
+    parser.add_argument(
+        '-a', '--activities', type=int, default=500,
+        help='Number of activities to generate (default: 500).')
+    parser.add_argument(
+        '-l', '--laps', type=int, default=10,
+        help='Laps per activity (default: 10).')
+    parser.add_argument(
+        '-p', '--points', type=int, default=60,
+        help='Trackpoints per lap (default: 60).')
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=3,
+        help='Number of runs per workload; the fastest is reported.')
+    parser.add_argument(
+        '--no-shortcuts', action='store_true',
+        help='Parse every element, like the original parser did.')
+    args = parser.parse_args()
+    shortcuts = getattr(gcparser.GCFileParser, 'Shortcuts', None)
+    if args.no_shortcuts and shortcuts is not None:
+        gcparser.GCFileParser.Shortcuts = shortcuts = False
+
+    where = tempfile.mkdtemp(prefix='garmin-bench-')
+    try:
+        generate(where, args.activities, args.laps, args.points)
+        print('Python {}, parser shortcuts: {}'.format(
+            sys.version.split()[0],
+            'n/a' if shortcuts is None else 'on' if shortcuts else 'off'))
+        for name, func in [('walk', bench_walk), ('parse', bench_parse)]:
+            seconds, count = timed(func, where, args.repeat)
+            print('{:<6} {:>8.1f} ms  ({} activities, {:.1f} us each)'.format(
+                name, seconds * 1000, count, seconds * 1e6 / max(count, 1)))
+    finally:
+        shutil.rmtree(where)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Measure the startup cost of each of our entry points: import each module in a
+fresh interpreter, and report the time taken, the peak memory use, and which
+of the heavy third-party packages ended up being loaded.
+
+Run it with the interpreter you are interested in, e.g.:
+
+    python3 bench_startup.py
+    python3 bench_startup.py -n 10 parser gp
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+EntryPoints = [
+    'garmin', 'policy', 'download', 'watch', 'parser', 'running', 'gp',
+    'training', 'aggregate', 'fsck', 'monthly', 'strava',
+    'activitites_for_upload',
+]
+
+HeavyPackages = [
+    'numpy', 'scipy', 'sklearn', 'matplotlib', 'mechanize', 'tweepy', 'gpxpy',
+]
+
+# Executed in a fresh interpreter; prints a JSON dict of measurements.
+Probe = r"""
+import json, resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.time()
+try:
+    __import__({module!r})
+    error = None
+except ImportError as e:
+    error = str(e)
+elapsed = time.time() - t0
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    'seconds': elapsed,
+    'rss_kb': after,
+    'rss_delta_kb': after - before,
+    'loaded': [p for p in {heavy!r} if p in sys.modules],
+    'error': error,
+}}))
+"""
+
+
+def measure(module, python=sys.executable):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = Probe.format(module=module, heavy=HeavyPackages)
+    out = subprocess.check_output([python, '-c', code], cwd=here)
+    return json.loads(out.decode('utf8').strip().splitlines()[-1])
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Measure import time and memory of each entry point.')
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help='Number of runs per module; the fastest run is reported.')
+    parser.add_argument(
+        'modules', nargs='*', default=EntryPoints,
+        help='Modules to measure (default: all entry points).')
+    args = parser.parse_args()
+
+    print('{:<24} {:>9} {:>10} {:>10}  {}'.format(
+        'module', 'ms', 'rss (MB)', '+rss (MB)', 'heavy packages loaded'))
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r['seconds'])
+        if best['error']:
+            print('{:<24} (cannot import: {})'.format(module, best['error']))
+            continue
+        print('{:<24} {:>9.1f} {:>10.1f} {:>10.1f}  {}'.format(
+            module, best['seconds'] * 1000, best['rss_kb'] / 1024.0,
+            best['rss_delta_kb'] / 1024.0, ', '.join(best['loaded']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Fixtures shared by the tests (test_*.py)."""
+
+import json
+import os
+
+import pytest
+
+from garmin import GarminStore
+
+TestData = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+
+
+def activity_json(activity_id, day='2015-06-07', sport='Running', km=10.0,
+                  seconds=3000.0, uom='kilometer'):
+    """Return a raw activity dict, as downloaded from Garmin Connect."""
+    return {
+        'activityId': activity_id,
+        'activityName': 'Activity {}'.format(activity_id),
+        'activityType': {'key': sport.lower(), 'display': sport},
+        'activitySummary': {
+            'BeginTimestamp': {'value': day + 'T07:00:00.000Z'},
+            'SumDistance': {'value': str(km), 'uom': uom},
+            'SumDuration': {'value': str(seconds), 'uom': 'second'},
+        },
+    }
+
+
+@pytest.fixture
+def testdata():
+    """Return the path of the given file in testdata/."""
+    return lambda filename: os.path.join(TestData, filename)
+
+
+@pytest.fixture
+def store(tmp_path):
+    """An empty GarminStore."""
+    return GarminStore(str(tmp_path))
+
+
+@pytest.fixture
+def make_activity():
+    """Return activity_json(), for building raw activity dicts."""
+    return activity_json
+
+
+@pytest.fixture
+def write_activity(store):
+    """Return a function writing activity_json(...) into the store."""
+    def write(activity_id, *args, **kwargs):
+        data = activity_json(activity_id, *args, **kwargs)
+        store.write('{}.json'.format(activity_id),
+                    json.dumps(data, sort_keys=True).encode('utf8'))
+    return write
@@ -1,4 +1,4 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 """
 This script was inspired from tmcw's Ruby script doing the same thing:
 
@@ -15,18 +15,23 @@ all the data into a single file, filter by workout type, and other features
 to be determined.
 """
 
-from __future__ import print_function
-
+import argparse
 import json
 import mechanize
 import os
 import re
-import urllib
+import urllib.parse
 
 from garmin import GarminStore
+from policy import FileTypePolicy
+
+
+class SessionExpired(RuntimeError):
+    """Garmin Connect no longer accepts our session; login() again."""
+    pass
 
 
-class GarminScraper(object):
+class GarminScraper:
 
     def __init__(self, username):
         self.username = username
@@ -43,7 +48,7 @@ class GarminScraper(object):
         # Say "hello" to Garmin Connect.
         self.agent.open(
             'https://sso.garmin.com/sso/login?' +
-            urllib.urlencode({
+            urllib.parse.urlencode({
                 'service': "https://connect.garmin.com/post-auth/login",
                 'clientId': 'GarminConnect',
             }))
@@ -55,7 +60,7 @@ class GarminScraper(object):
         self.agent['password'] = password
 
         # Submit the login!
-        response = self.agent.submit().get_data()
+        response = self.agent.submit().get_data().decode('utf8')
         if 'Invalid' in response:
             raise RuntimeError('Login failed! Check your credentials, or submit a bug report.')
         elif 'SUCCESS' in response:
@@ -64,25 +69,49 @@ class GarminScraper(object):
             raise RuntimeError('UNKNOWN STATE. This script may need to be updated. Submit a bug report.')
 
         # Now we need a very specific URL from the response.
-        response_url = re.search("response_url\s*=\s*'(.*)';", response).group(1)
+        response_url = re.search(r"response_url\s*=\s*'(.*)';", response).group(1)
         self.agent.open(response_url)
 
         # In theory, we're in.
 
-    def activities(self, limit=None):
+    @staticmethod
+    def search_query(params):
+        """Build an activity-search query string from (key, value) pairs.
+
+        Keys ending in '>' or '<' (e.g. 'beginTimestamp>') are comparisons,
+        and are joined directly to their value instead of with '='."""
+        parts = []
+        for key, value in params:
+            if key.endswith(('>', '<')):
+                parts.append(key + urllib.parse.quote(str(value)))
+            else:
+                parts.append(urllib.parse.urlencode({key: value}))
+        return ''.join('&' + part for part in parts)
+
+    def activities(self, limit=None, params=()):
         """Generate activities in reverse chronological order.
 
         Yields 'raw' activity dicts parsed from the JSON retrieved from the
-        server."""
+        server. The optional params are (key, value) pairs passed on to the
+        activity-search service to filter activities server-side (see
+        FileTypePolicy.search_params())."""
         activities_url = "http://connect.garmin.com/proxy/activity-search-service-1.2/json/activities?start={start}&limit={limit}"
+        query = self.search_query(params)
 
         batch_size = 100  # Max #activities to retrieve per request.
         i = 0
         while limit is None or i < limit:
             if limit is not None:
                 batch_size = min(batch_size, limit - i)
-            url = activities_url.format(start=i, limit=batch_size)
-            response = json.loads(self.agent.open(url).get_data())
+            url = activities_url.format(start=i, limit=batch_size) + query
+            try:
+                response = json.loads(self.agent.open(url).get_data())
+            except ValueError:  # Redirected to a (non-JSON) sign-in page
+                raise SessionExpired(self.username)
+            except mechanize.HTTPError as e:
+                if int(e.code) in (401, 403):
+                    raise SessionExpired(self.username)
+                raise
             total_activities = response['results']['totalFound']
             for item in response['results']['activities']:
                 yield item['activity']
@@ -91,7 +120,7 @@ class GarminScraper(object):
                 break
 
     FileType = {
-        'json': lambda a: json.dumps(a, sort_keys=True),
+        'json': lambda a: json.dumps(a, sort_keys=True).encode('utf8'),
         'orig.zip': "https://connect.garmin.com/proxy/download-service/files/activity/{activityId}",
         'tcx': "https://connect.garmin.com/proxy/activity-service-1.1/tcx/activity/{activityId}?full=true",
         'gpx': "https://connect.garmin.com/proxy/activity-service-1.1/gpx/activity/{activityId}?full=true",
@@ -99,7 +128,11 @@ class GarminScraper(object):
         'csv': "https://connect.garmin.com/csvExporter/{activityId}.csv",
     }
 
-    def download(self, activity, filetype):
+    def download(self, activity, filetype, max_size=None):
+        """Download the given file type for the given activity.
+
+        Raises KeyError if the file does not exist on the server, and
+        ValueError if the server reports it to be larger than max_size."""
         handler = self.FileType[filetype]
         if callable(handler):
             return handler(activity)
@@ -108,12 +141,21 @@ class GarminScraper(object):
             #  - HTTP 500 when the .kml file does not exist
             #  - HTTP 404 when the .orig.zip file does not exist
             try:
-                return self.agent.open(handler.format(**activity)).get_data()
+                response = self.agent.open(handler.format(**activity))
+                size = response.info().get('Content-Length')
+                if (max_size is not None and size is not None and
+                        int(size) > max_size):
+                    response.close()
+                    raise ValueError('{}.{} is too large ({} bytes)'.format(
+                        activity['activityId'], filetype, size))
+                return response.get_data()
             except mechanize.HTTPError as e:
                 if (int(e.code), filetype) in [(404, 'orig.zip'),
                                                (500, 'kml')]:
                     raise KeyError('{}.{}'.format(
                         activity['activityId'], filetype))
+                elif int(e.code) in (401, 403):
+                    raise SessionExpired(self.username)
                 else:
                     raise
 
@@ -126,7 +168,7 @@ class GarminScraper(object):
 def credentials_from_prompt():
     import getpass
     print("Please fill in your Garmin account credentials (NOT saved).")
-    yield raw_input('Username: '), getpass.getpass('Password: ')
+    yield input('Username: '), getpass.getpass('Password: ')
 
 
 def credentials_from_file(f):
@@ -138,8 +180,193 @@ def credentials_from_file(f):
             print('Skipping malformed line "{}"'.format(line.strip()))
 
 
+def sync(remote, local, policy, stop_after=None):
+    """Download activities from remote (GarminScraper) into local (GarminStore).
+
+    Only activities and file types selected by policy (FileTypePolicy) are
+    downloaded. Activities are visited in reverse chronological order; if
+    stop_after is given, stop after seeing that many consecutive activities
+    whose JSON is unchanged since the previous download session (i.e. assume
+    that all older activities are unchanged as well).
+
+    Files queued for re-download in local (e.g. by fsck.py) are downloaded
+    first. A queued .json file cannot be fetched on its own, so it instead
+    forces a full sync: not stop_after-limited, and listing all activities
+    (not just those selected by the policy on the server side). Queued files
+    are removed from the queue once they have been written. After a full
+    sync, files of activities that are gone from Garmin Connect, or that the
+    policy does not want, are dropped from the queue as well.
+
+    Returns the list of raw activity dicts that were new or changed."""
+    redownload(remote, local, policy)
+    queued = set(local.queued())
+    full = any(filename.endswith('.json') for filename in queued)
+    if full:
+        stop_after = None
+
+    def written(filename):
+        if filename in queued:
+            local.dequeue(filename)
+            queued.discard(filename)
+
+    changed = []
+    seen = set()  # All activity IDs listed
+    unwanted = set()  # Activity IDs listed, but not wanted by the policy
+    unchanged_in_a_row = 0
+    params = () if full else policy.search_params()
+    for activity in remote.activities(params=params):
+        seen.add(str(activity['activityId']))
+        if not policy.wants(activity):
+            unwanted.add(str(activity['activityId']))
+            continue
+        json_filename = remote.filename(activity, 'json')
+        remote_json = remote.download(activity, 'json')
+        try:
+            local_json = local.read(json_filename)
+        except KeyError:
+            local_json = None
+
+        # If JSON data is unchanged from previous download session, then we
+        # assume that any associated (same activity - different file types)
+        # previous downloads are unchanged as well
+        if local_json == remote_json:
+            print('Skipping {} (already exists)...'.format(json_filename))
+            unchanged = True
+        else:
+            print('Downloading {}...'.format(json_filename))
+            local.write(json_filename, remote_json)
+            unchanged = False
+            changed.append(activity)
+        written(json_filename)
+
+        for filetype in policy.filetypes(activity):
+            filename = remote.filename(activity, filetype)
+            if unchanged and filename in local:
+                print('Skipping {} (already exists)...'.format(filename))
+                continue
+            print('Downloading {}...'.format(filename))
+            try:
+                local.write(filename, remote.download(
+                    activity, filetype, policy.max_size))
+            except KeyError:
+                print('Failed to download {}. Skipping!'.format(filename))
+                continue
+            except ValueError as e:
+                print('{}. Skipping!'.format(e))
+                continue
+            except mechanize.HTTPError as e:
+                # Most likely a server-side problem with this one file;
+                # don't let it stop the other activities from syncing.
+                print('Failed to download {} ({}). Skipping!'.format(
+                    filename, e))
+                continue
+            written(filename)
+
+        unchanged_in_a_row = unchanged_in_a_row + 1 if unchanged else 0
+        if stop_after is not None and unchanged_in_a_row >= stop_after:
+            break
+    else:
+        # Full sync: whatever is still queued for an activity that is not
+        # listed (or not wanted) will never be downloaded.
+        for filename in sorted(queued) if full else []:
+            activity_id = filename.split('.', 1)[0]
+            if activity_id not in seen:
+                reason = 'is gone from Garmin Connect'
+            elif activity_id in unwanted:
+                reason = 'is not wanted by the download policy'
+            else:
+                continue
+            print('{} {}. Skipping!'.format(filename, reason))
+            local.dequeue(filename)
+    return changed
+
+
+def redownload(remote, local, policy):
+    """Download the files queued for re-download in local (GarminStore).
+
+    Files are removed from the queue once written, or if the policy does not
+    want them. Queued .json files (and files whose activity has no .json
+    file) are left for sync() to handle; the missing .json files are queued
+    as well."""
+    for filename in local.queued():
+        activity_id, filetype = filename.split('.', 1)
+        if filetype == 'json':
+            continue
+        try:
+            activity = json.loads(local.read(activity_id + '.json'))
+        except (KeyError, ValueError):
+            # Without the activity's JSON we cannot download its files, but
+            # a full sync will download them along with the JSON.
+            local.enqueue([activity_id + '.json'])
+            continue
+        if filetype not in policy.filetypes(activity):
+            print('{} is not wanted by the download policy. Skipping!'.format(
+                filename))
+            local.dequeue(filename)
+            continue
+        print('Re-downloading {}...'.format(filename))
+        try:
+            local.write(filename, remote.download(
+                activity, filetype, policy.max_size))
+        except KeyError:
+            print('Failed to download {}. Skipping!'.format(filename))
+            continue
+        except ValueError as e:
+            print('{}. Skipping!'.format(e))
+            continue
+        except mechanize.HTTPError as e:
+            print('Failed to download {} ({}). Skipping!'.format(filename, e))
+            continue
+        local.dequeue(filename)
+
+
+def add_policy_arguments(parser):
+    """Add command-line options for building a FileTypePolicy."""
+    parser.add_argument(
+        '-p', '--policy', required=False, type=argparse.FileType('r'),
+        help='JSON file describing which files to download (see policy.py).')
+    parser.add_argument(
+        '-f', '--filetypes', required=False,
+        type=FileTypePolicy.parse_filetypes,
+        help='Comma-separated file types to download by default ({}).'.format(
+            ','.join(FileTypePolicy.Default)))
+    parser.add_argument(
+        '-r', '--rule', action='append', default=[],
+        type=FileTypePolicy.parse_rule,
+        help='Per-activity-type file types, e.g. "cycling=orig.zip". '
+             'May be given multiple times.')
+    parser.add_argument(
+        '-t', '--type', action='append', default=[],
+        type=lambda s: s.strip().lower(),
+        help='Only download activities of this type, e.g. "running". '
+             'May be given multiple times.')
+    parser.add_argument(
+        '--since', required=False, type=FileTypePolicy.parse_date,
+        help='Only download activities starting on/after this YYYY-MM-DD.')
+    parser.add_argument(
+        '--until', required=False, type=FileTypePolicy.parse_date,
+        help='Only download activities starting before this YYYY-MM-DD.')
+    parser.add_argument(
+        '--max-size', required=False, type=int,
+        help='Skip files larger than this many bytes.')
+
+
+def policy_from_args(parser, args):
+    """Build a FileTypePolicy from options added by add_policy_arguments()."""
+    if args.policy:
+        policy = FileTypePolicy.from_config(args.policy)
+    else:
+        policy = FileTypePolicy()
+    policy.update(default=args.filetypes, rules=args.rule, types=args.type,
+                  since=args.since, until=args.until, max_size=args.max_size)
+    try:
+        policy.validate(GarminScraper.FileType.keys())
+    except ValueError as e:
+        parser.error(str(e))
+    return policy
+
+
 def main():
-    import argparse
     parser = argparse.ArgumentParser(
         description='Garmin Data Scraper',
         epilog='Because the hell with APIs!')
@@ -149,7 +376,9 @@ def main():
     parser.add_argument(
         '-o', '--output', required=False, default='.',
         help='Output directory.')
+    add_policy_arguments(parser)
     args = parser.parse_args()
+    policy = policy_from_args(parser, args)
 
     if args.csv:
         credentials = credentials_from_file(args.csv)
@@ -163,37 +392,7 @@ def main():
         local = GarminStore(os.path.join(args.output, username))
         print('Downloading from {}\'s Garmin account into {}/...'.format(
             username, local.basedir))
-
-        for activity in remote.activities():
-            json_filename = remote.filename(activity, 'json')
-            remote_json = remote.download(activity, 'json')
-            try:
-                local_json = local.read(json_filename)
-            except KeyError:
-                local_json = None
-
-            # If JSON data is unchanged from previous download session, then we
-            # assume that any associated (same activity - different file types)
-            # previous downloads are unchanged as well
-            if local_json == remote_json:
-                print('Skipping {} (already exists)...'.format(json_filename))
-                unchanged = True
-            else:
-                print('Downloading {}...'.format(json_filename))
-                local.write(json_filename, remote_json)
-                unchanged = False
-
-            for filetype in set(remote.FileType.keys()) - {'json'}:
-                filename = remote.filename(activity, filetype)
-                if unchanged and filename in local:
-                    print('Skipping {} (already exists)...'.format(filename))
-                    continue
-                print('Downloading {}...'.format(filename))
-                try:
-                    local.write(filename, remote.download(activity, filetype))
-                except KeyError:
-                    print('Failed to download {}. Skipping!'.format(filename))
-                    continue
+        sync(remote, local, policy)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Check the integrity of a GarminStore (or a directory of them, as created by
+download.py), without talking to Garmin Connect.
+
+Every file gets a cheap check: empty files, XML files (.tcx, .gpx, .kml) that
+do not end with their closing root tag (i.e. truncated downloads), .orig.zip
+files that fail their CRC check, and .json files that do not parse. We also
+report leftover .tmp files from interrupted downloads, activities missing some
+of the file types that the download policy (the same options as download.py)
+wants for them, data files without a .json file, and duplicate activities
+(same type and start time, different activity IDs).
+
+With --repair, broken and missing files are queued for re-download by the next
+run of download.py or watch.py (broken files are removed). With --compact,
+stale .tmp files are removed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import json
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import zipfile
+
+from garmin import GarminStore
+from policy import FileTypePolicy
+
+# How to recognize a complete XML file of each type, from its last bytes.
+XmlTails = {
+    'tcx': b'</TrainingCenterDatabase>',
+    'gpx': b'</gpx>',
+    'kml': b'</kml>',
+}
+TailSize = 256
+
+# File types that download.py may put in a store.
+DataTypes = ('json', 'orig.zip', 'tcx', 'gpx', 'kml', 'csv')
+
+
+@dataclass(slots=True)
+class Problem:
+    path: str
+    kind: str  # tmp, empty, truncated, corrupt, missing, orphan, duplicate
+    detail: str = ''
+
+    def __str__(self) -> str:
+        return '{:<9} {}{}'.format(
+            self.kind, self.path, ': ' + self.detail if self.detail else '')
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def store(self) -> str:
+        return os.path.dirname(self.path)
+
+
+def check_file(path: str, policy: FileTypePolicy
+               ) -> Tuple[Optional[Problem], Optional[Tuple]]:
+    """Check one (non-.tmp) file in the store.
+
+    Returns the problem found (if any), and for .json files the file types
+    the policy wants for the activity and the (activity type, start time)
+    used to detect duplicates (None if unknown)."""
+    filetype = os.path.basename(path).split('.', 1)[1]
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return Problem(path, 'empty'), None
+        if filetype in XmlTails:
+            with open(path, 'rb') as f:
+                f.seek(max(0, size - TailSize))
+                if not f.read().rstrip().endswith(XmlTails[filetype]):
+                    return Problem(path, 'truncated'), None
+        elif filetype == 'orig.zip':
+            with zipfile.ZipFile(path) as z:
+                bad = z.testzip()
+            if bad is not None:
+                return Problem(path, 'corrupt', 'bad CRC for ' + bad), None
+        elif filetype == 'json':
+            with open(path, 'rb') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                return Problem(path, 'corrupt', 'not a JSON object'), None
+            when = FileTypePolicy.activity_time(data)
+            key = None if when is None else (
+                FileTypePolicy.activity_type(data), when)
+            return None, (policy.filetypes(data), key)
+    except (zipfile.BadZipFile, ValueError) as e:
+        return Problem(path, 'corrupt', '{}: {}'.format(
+            type(e).__name__, e)), None
+    except OSError as e:
+        return Problem(path, 'corrupt', str(e)), None
+    return None, None
+
+
+def scan(basedir: str, policy: Optional[FileTypePolicy] = None,
+         threads: Optional[int] = None,
+         tmp_age: float = 3600.0) -> List[Problem]:
+    """Scan all stores below basedir. Return the problems found.
+
+    Each activity is expected to have the file types that policy (default:
+    download.py's default policy) wants for it. .tmp files younger than
+    tmp_age seconds are assumed to belong to a download in progress, and
+    are not reported."""
+    if policy is None:
+        policy = FileTypePolicy()
+    problems = []
+    paths = []
+    names: Dict[str, Set[str]] = {}  # directory -> file names
+    now = time.time()
+    for dirpath, dirnames, filenames in os.walk(basedir):
+        names[dirpath] = set(filenames)
+        for fname in filenames:
+            path = os.path.join(dirpath, fname)
+            if fname.endswith('.tmp'):
+                try:
+                    age = now - os.path.getmtime(path)
+                except OSError:  # Download completed since os.walk()
+                    continue
+                if age >= tmp_age:
+                    problems.append(Problem(
+                        path, 'tmp', '{:.0f} hours old'.format(age / 3600)))
+                continue
+            activity_id, _, filetype = fname.partition('.')
+            if not activity_id.isdigit() or filetype not in DataTypes:
+                continue  # Not an activity file (e.g. an index)
+            paths.append(path)
+            if filetype != 'json' and activity_id + '.json' not in filenames:
+                problems.append(Problem(path, 'orphan', 'no .json file'))
+
+    # Most of the time is spent waiting for I/O, so threads will do.
+    seen: Dict[Tuple[str, Tuple], str] = {}
+    with ThreadPoolExecutor(threads) as executor:
+        for path, (problem, info) in zip(
+                paths, executor.map(lambda p: check_file(p, policy), paths)):
+            if problem is not None:
+                problems.append(problem)
+            if info is None:
+                continue
+            filetypes, key = info
+            dirpath = os.path.dirname(path)
+            activity_id = os.path.basename(path).split('.', 1)[0]
+            for t in filetypes:
+                filename = '{}.{}'.format(activity_id, t)
+                if filename not in names[dirpath]:
+                    problems.append(Problem(
+                        os.path.join(dirpath, filename), 'missing'))
+            if key is None:
+                continue
+            key = (dirpath, key)
+            if key in seen:
+                first, other = sorted([seen[key], path])
+                problems.append(Problem(other, 'duplicate', 'same as {}'.format(
+                    os.path.basename(first))))
+            else:
+                seen[key] = path
+    problems.sort(key=lambda p: p.path)
+    return problems
+
+
+def repair(problems: List[Problem], compact: bool = False) -> int:
+    """Queue broken/missing files for re-download, and remove broken files.
+
+    If compact is given, also remove stale .tmp files. Return #fixed."""
+    fixed = 0
+    queues: Dict[str, List[str]] = {}
+    for problem in problems:
+        if problem.kind == 'tmp' and compact:
+            os.remove(problem.path)
+        elif problem.kind in ('empty', 'truncated', 'corrupt', 'missing'):
+            if os.path.exists(problem.path):
+                os.remove(problem.path)
+            queues.setdefault(problem.store, []).append(problem.filename)
+        else:
+            continue
+        fixed += 1
+    for store, filenames in queues.items():
+        GarminStore(store).enqueue(filenames)
+    return fixed
+
+
+def main():
+    import argparse
+    # Imported here, as download.py pulls in mechanize.
+    from download import add_policy_arguments, policy_from_args
+
+    parser = argparse.ArgumentParser(description='Garmin store checker')
+    parser.add_argument(
+        '-d', '--dir', default='.',
+        help='Directory where Garmin activities are stored (may contain '
+             'one directory per user, as created by download.py).')
+    parser.add_argument(
+        '--repair', action='store_true',
+        help='Remove broken files, and queue broken/missing files for '
+             're-download by the next download.py/watch.py run.')
+    parser.add_argument(
+        '-c', '--compact', action='store_true',
+        help='Remove stale .tmp files left by interrupted downloads.')
+    parser.add_argument(
+        '--tmp-age', type=float, default=3600.0,
+        help='Ignore .tmp files younger than this many seconds (default: '
+             '3600), as they may belong to a download in progress.')
+    parser.add_argument(
+        '-j', '--threads', type=int, default=None,
+        help='Number of threads checking files.')
+    # The download policy decides which file types each activity should have.
+    add_policy_arguments(parser)
+    args = parser.parse_args()
+    policy = policy_from_args(parser, args)
+
+    start = time.time()
+    problems = scan(args.dir, policy, args.threads, args.tmp_age)
+    for problem in problems:
+        print(problem)
+    print('Found {} problems in {} in {:.1f}s'.format(
+        len(problems), args.dir, time.time() - start))
+    if args.repair or args.compact:
+        if args.compact and not args.repair:
+            problems = [p for p in problems if p.kind == 'tmp']
+        print('Fixed {} problems'.format(repair(problems, args.compact)))
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,20 @@
-#!/usr/bin/env python2
-
-from __future__ import print_function
+#!/usr/bin/env python3
 
 from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
 import json
 import os
+from typing import Any, Dict, Iterable, Iterator, List
+import warnings
+
 
+@dataclass(slots=True)
+class Activity:
+    """An activity in a GarminStore, backed by its .json summary file."""
 
-class Activity(object):
+    json_path: str
+    json: Dict[str, Any] = field(repr=False)
 
     FileType = {
         'json': '.json',
@@ -18,60 +24,92 @@ class Activity(object):
         'kml': '.kml',
         'csv': '.csv',
         'fit': '.fit',
+        'samples': '.samples.npz',  # Cached trackpoints (see training.py)
     }
 
-    def __init__(self, json_path):
-        self.json_path = json_path
-        with open(self.json_path) as f:
-            self.json = json.load(f)
-        assert os.path.basename(self.json_path) == self.filename('json')
+    @classmethod
+    def load(cls, json_path: str) -> 'Activity':
+        with open(json_path, 'rb') as f:
+            activity = cls(json_path, json.load(f))
+        assert os.path.basename(json_path) == activity.filename('json')
+        return activity
 
-    def __unicode__(self):
-        return u'{} {} {}: {}'.format(
+    def __str__(self) -> str:
+        return '{} {} {}: {}'.format(
             self.when, self.activityId, self.what, self.name)
 
-    def __str__(self):
-        return unicode(self).encode('utf8')
-
     @property
-    def activityId(self):
+    def activityId(self) -> int:
         return self.json['activityId']
 
     @property
-    def when(self):
+    def when(self) -> datetime:
         return datetime.strptime(
             self.json['activitySummary']['BeginTimestamp']['value'],
             '%Y-%m-%dT%H:%M:%S.000Z')
 
     @property
-    def what(self):
+    def what(self) -> str:
         return self.json['activityType']['display']
 
     @property
-    def name(self):
+    def name(self) -> str:
         return self.json['activityName']
 
-    def filename(self, filetype):
+    Units = {
+        'meter': 1.0,
+        'kilometer': 1000.0,
+        'mile': 1609.344,
+        'millisecond': 0.001,
+        'second': 1.0,
+        'minute': 60.0,
+        'hour': 3600.0,
+    }
+
+    def _summary(self, key: str, default_uom: str) -> float:
+        try:
+            item = self.json['activitySummary'][key]
+        except KeyError:
+            return 0.0
+        uom = item.get('uom', default_uom)
+        try:
+            return float(item['value']) * self.Units[uom]
+        except (KeyError, ValueError):  # Unknown unit or malformed value
+            warnings.warn('{}: ignoring {} of {!r} {}'.format(
+                self.json_path, key, item.get('value'), uom))
+            return 0.0
+
+    @property
+    def distance(self) -> float:
+        """Total distance (in meters)."""
+        return self._summary('SumDistance', 'meter')
+
+    @property
+    def duration(self) -> float:
+        """Total duration (in seconds)."""
+        return self._summary('SumDuration', 'second')
+
+    def filename(self, filetype: str) -> str:
         return str(self.activityId) + self.FileType[filetype]
 
-    def path(self, filetype):
+    def path(self, filetype: str) -> str:
         return os.path.join(os.path.dirname(self.json_path),
                             self.filename(filetype))
 
 
-class GarminStore(object):
+class GarminStore:
 
-    def __init__(self, where):
+    def __init__(self, where: str):
         self.basedir = where
 
         if not os.path.exists(self.basedir):
             os.makedirs(self.basedir)
 
-    def path(self, filename):
+    def path(self, filename: str) -> str:
         assert os.sep not in filename
         return os.path.join(self.basedir, filename)
 
-    def __contains__(self, filename):
+    def __contains__(self, filename: str) -> bool:
         return os.path.exists(self.path(filename))
 
     @contextmanager
@@ -87,7 +125,7 @@ class GarminStore(object):
         f = open(path, 'wb')
         try:
             yield f
-        except:  # failure -> roll back
+        except BaseException:  # failure -> roll back
             f.close()
             os.remove(path)
             raise
@@ -95,17 +133,37 @@ class GarminStore(object):
             f.close()
             os.rename(path, self.path(filename))
 
-    def read(self, filename):
+    def read(self, filename: str) -> bytes:
         if filename not in self:
             raise KeyError(filename)
         with self.open(filename, 'r') as f:
             return f.read()
 
-    def write(self, filename, data):
+    def write(self, filename: str, data: bytes) -> None:
         with self.open(filename, 'w') as f:
             f.write(data)
 
-    def walk(self, sorted=False):
+    # Files to be re-downloaded by the next sync (see fsck.py)
+    RedownloadQueue = 'redownload.json'
+
+    def queued(self) -> List[str]:
+        try:
+            return json.loads(self.read(self.RedownloadQueue))
+        except KeyError:
+            return []
+
+    def enqueue(self, filenames: Iterable[str]) -> None:
+        queue = sorted(set(self.queued()) | set(filenames))
+        self.write(self.RedownloadQueue, json.dumps(queue).encode('utf8'))
+
+    def dequeue(self, filename: str) -> None:
+        queue = [f for f in self.queued() if f != filename]
+        if queue:
+            self.write(self.RedownloadQueue, json.dumps(queue).encode('utf8'))
+        elif self.RedownloadQueue in self:
+            os.remove(self.path(self.RedownloadQueue))
+
+    def walk(self, sorted: bool = False) -> Iterator[Activity]:
         for dirpath, dirnames, filenames in os.walk(self.basedir):
             if sorted:
                 # Garmin's activity IDs (i.e. filenames) are usually - but not
@@ -116,8 +174,9 @@ class GarminStore(object):
                 # as opposed to the order in which they happened in real time.
                 filenames.sort()
             for fname in filenames:
-                if fname.endswith('.json'):
-                    yield Activity(os.path.join(dirpath, fname))
+                # Skip other .json files (e.g. indexes) kept in the store
+                if fname.endswith('.json') and fname[:-5].isdigit():
+                    yield Activity.load(os.path.join(dirpath, fname))
 
 
 def main():
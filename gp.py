@@ -1,65 +1,113 @@
 import argparse
+import hashlib
+import html
+import io
+import json
+import multiprocessing
 import numpy as np
+import xml.parsers.expat
 from datetime import datetime
-import sklearn.gaussian_process as gp
-import matplotlib.pyplot as plot
 import parser as gcparser
 import os
 import os.path
 import running
 
-def main(indir, outdir):
+# Bump this to force re-rendering of all batch reports.
+REPORT_VERSION = 1
+
+def main(indir, outdir, formats = ('png',)):
+    """
+    Main driver method. Plots the pace trend of all runs in indir. The plot
+    is shown interactively, or written to outdir if given. Returns the exit
+    status: non-zero if there was nothing to plot, or rendering failed.
     """
-    Main driver method.
+    # Generate a list of all the files, and parse each file.
+    timestamps, y, dy = load_runs(indir, verbose = True)
+    if np.size(timestamps) < 2:
+        print('Need at least 2 runs in %s, found %d' % (indir, np.size(timestamps)))
+        return 1
+
+    if outdir is None:
+        # Plotting and modelling libraries are slow to import; only load
+        # them when actually needed, so that importing this module stays
+        # cheap.
+        import matplotlib.pyplot as plot
+        plot_trend(plot, timestamps, y, dy)
+        plot.show()
+    else:
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        error = render_report(('pace', os.path.join(outdir, 'pace'),
+                               timestamps, y, dy, formats))
+        if error is not None:
+            print('Failed to render %s' % error)
+            return 1
+    return 0
+
+def load_runs(indir, verbose = False):
     """
-    # Generate a list of all the files.
-    listing = filelisting(indir)
+    Parses all the .tcx files in a directory. Files that cannot be parsed
+    (e.g. truncated downloads) are reported and skipped.
 
-    # Parse each file.
+    Returns
+    -------
+    timestamps : array, shape (N,)
+        Start time of each run (in seconds since the epoch), sorted.
+    y : array, shape (N,)
+        Average pace (in minutes per mile) of each run.
+    dy : array, shape (N,)
+        Standard deviation of the split times of each run.
+    """
     timestamps = []
-    distances = []
-    splits = []
-    i = 0
-    for f in listing:
-        p = gcparser.GCFileParser(f)
-        t, d, s = p.parse()
-        if t is None and d is None and s is None: continue
+    y = []
+    dy = []
+    for f in filelisting(indir):
+        try:
+            run = gcparser.GCFileParser(f).parse_run()
+        except (xml.parsers.expat.ExpatError, ValueError) as e:
+            print('Skipping %s: %s' % (f, e))
+            continue
+        if run is None: continue
 
         # Append the data.
-        timestamps.append(t)
-        distances.append(d)
-        splits.append(s)
-
-        i += 1
+        d = running.metersToMiles(run.distances)
+        s = running.secondsToMinutes(run.times)
+        timestamps.append(run.timestamp)
+        y.append(running.averagePace(d, s))
+        dy.append(np.std(s))
 
-        print '.'
+        if verbose: print('.')
 
     # Sort the data.
     timestamps = np.array(timestamps)
-    numRuns = np.size(timestamps)
     sortInd = np.argsort(timestamps)
+    return timestamps[sortInd], np.array(y)[sortInd], np.array(dy)[sortInd]
+
+def plot_trend(plot, timestamps, y, dy):
+    """
+    Fits a Gaussian process to the given runs (see load_runs()), and plots
+    the prediction onto the current figure of the given pyplot module.
+    """
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, ConstantKernel
 
     # Loop through the sorted arrays, generating a graph.
+    numRuns = np.size(timestamps)
     X = np.atleast_2d(np.linspace(0, numRuns, numRuns, endpoint = False)).T
-    y = np.zeros(np.size(timestamps))
-    dy = np.zeros(np.size(y))
-    for i in range(0, np.size(sortInd)):
-        ind = sortInd[i]
-        d = running.metersToMiles(distances[ind])
-        s = running.secondsToMinutes(splits[ind])
-        y[i] = running.averagePace(d, s)
-        dy[i] = np.std(s)
-
-    dy += 0.01
-    process = gp.GaussianProcess(corr = 'squared_exponential',
-        nugget = (dy / y) ** 2, theta0 = 1e-1, thetaL = 1e-3,
-        thetaU = 1, random_start = 100)
+    dy = dy + 0.01
+    # Squared exponential correlation exp(-theta * d**2), with theta in
+    # [1e-3, 1] starting at 1e-1, expressed as an RBF length scale.
+    kernel = ConstantKernel() * RBF(length_scale = 1 / np.sqrt(2 * 1e-1),
+        length_scale_bounds = (1 / np.sqrt(2 * 1), 1 / np.sqrt(2 * 1e-3)))
+    process = GaussianProcessRegressor(kernel = kernel,
+        alpha = (dy / y) ** 2, normalize_y = True,
+        n_restarts_optimizer = 100)
     process.fit(X, y)
 
     # Set up a prediction.
     x = np.atleast_2d(np.linspace(0, numRuns, numRuns * 10)).T
-    y_pred, MSE = process.predict(x, eval_MSE = True)
-    sigma = np.sqrt(MSE)
+    y_pred, sigma = process.predict(x, return_std = True)
+    x = x.ravel()
 
     # Plot the prediction and the 95% confidence interval.
     plot.plot(X.ravel(), y, c = 'r', marker = '+', ls = 'None', markersize = 10, label = 'Runs')
@@ -70,11 +118,52 @@ def main(indir, outdir):
             alpha = 0.5, fc = 'b', ec = 'None', label = '95% confidence')
     plot.ylabel('Average Pace (minutes)')
     locs, labels = plot.xticks()
-    locs = locs[np.where(locs < numRuns)]
-    newlabels = [datetime.fromtimestamp(timestamps[loc]).strftime("%Y/%m/%d") for loc in locs]
+    locs = locs[np.where((locs >= 0) & (locs < numRuns))]
+    newlabels = [datetime.fromtimestamp(timestamps[int(loc)]).strftime("%Y/%m/%d") for loc in locs]
     plot.xticks(locs, newlabels)
     plot.legend(loc = 0)
-    plot.show()
+
+def render_report(job):
+    """
+    Renders one report with a non-interactive backend. Runs in a worker
+    process when called from batch().
+
+    Parameters
+    ----------
+    job : tuple
+        (title, output path without extension, timestamps, y, dy, formats),
+        where formats is a sequence of 'png', 'svg' and/or 'html'.
+
+    Returns
+    -------
+    error : str or None
+        Error message if the report could not be rendered.
+    """
+    title, outpath, timestamps, y, dy, formats = job
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plot
+
+    plot.figure()
+    try:
+        plot_trend(plot, timestamps, y, dy)
+        plot.title(title)
+        for fmt in formats:
+            if fmt == 'html':
+                svg = io.StringIO()
+                plot.savefig(svg, format = 'svg')
+                with open(outpath + '.html', 'w') as f:
+                    f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                            '<title>%s</title></head><body>\n' % html.escape(title))
+                    f.write(svg.getvalue())
+                    f.write('\n</body></html>\n')
+            else:
+                plot.savefig(outpath + '.' + fmt, format = fmt)
+    except Exception as e:
+        return '%s: %s' % (title, e)
+    finally:
+        plot.close()
+    return None
 
 def filelisting(directory, suffix = 'tcx'):
     """
@@ -87,14 +176,151 @@ def filelisting(directory, suffix = 'tcx'):
             files.append(fullpath)
     return files
 
+def fingerprint(directory, suffix = 'tcx'):
+    """
+    Computes a cheap fingerprint (names, sizes and modification times) of
+    all the files in the directory.
+    """
+    h = hashlib.sha1()
+    for path in sorted(filelisting(directory, suffix)):
+        st = os.stat(path)
+        h.update(('%s %d %d\n' % (os.path.basename(path), st.st_size, st.st_mtime)).encode('utf8'))
+    return h.hexdigest()
+
+def periods(timestamps, kind):
+    """
+    Splits runs into calendar periods.
+
+    Parameters
+    ----------
+    timestamps : array, shape (N,)
+        Start time of each run (in seconds since the epoch).
+    kind : str
+        One of 'all', 'year' or 'month'.
+
+    Returns
+    -------
+    periods : list of (name, mask)
+        Name of each period (e.g. 'all', '2015' or '2015-03'), and a
+        boolean array selecting the runs in that period.
+    """
+    if kind == 'all':
+        return [('all', np.ones(np.size(timestamps), dtype = bool))]
+    fmt = {'year': '%Y', 'month': '%Y-%m'}[kind]
+    keys = np.array([datetime.fromtimestamp(t).strftime(fmt) for t in timestamps])
+    return [(key, keys == key) for key in sorted(set(keys))]
+
+def batch(indir, outdir, kinds = ('all',), formats = ('png',),
+          processes = None, force = False):
+    """
+    Renders pace reports for every user directory (as created by
+    download.py) in indir, and every period, into outdir/<user>/.
+
+    Each user's runs are parsed once and shared between all of that user's
+    reports. Reports are rendered in parallel by a pool of processes.
+    Reports whose input data is unchanged since the last batch run are
+    skipped, unless force is given. Returns the number of failed reports.
+    """
+    users = sorted(u for u in os.listdir(indir)
+                   if os.path.isdir(os.path.join(indir, u)))
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Skip users whose files are unchanged, and whose reports exist.
+        todo = []
+        for user in users:
+            userdir = os.path.join(outdir, user)
+            if not force and unchanged(load_stamps(userdir), os.path.join(indir, user),
+                                       userdir, kinds, formats):
+                print('Skipping %s (unchanged)' % user)
+                continue
+            todo.append(user)
+
+        # Prepare the data for each user, in parallel.
+        runs = pool.map(load_runs, [os.path.join(indir, u) for u in todo])
+
+        # Work out which reports need (re-)rendering.
+        jobs = []
+        allstamps = {}
+        for user, (timestamps, y, dy) in zip(todo, runs):
+            userdir = os.path.join(outdir, user)
+            if not os.path.isdir(userdir):
+                os.makedirs(userdir)
+            old = load_stamps(userdir).get('reports', {})
+            new = {}
+            for kind in kinds:
+                for name, mask in periods(timestamps, kind):
+                    if np.count_nonzero(mask) < 2: continue
+                    new[name] = report_stamp(timestamps[mask], y[mask], dy[mask])
+                    outpath = os.path.join(userdir, 'pace-' + name)
+                    if (not force and old.get(name) == new[name] and
+                            all(os.path.exists(outpath + '.' + f) for f in formats)):
+                        continue
+                    jobs.append(('%s: %s' % (user, name), outpath,
+                                 timestamps[mask], y[mask], dy[mask], formats))
+            allstamps[user] = {
+                'version': REPORT_VERSION,
+                'kinds': sorted(kinds),
+                'formats': sorted(formats),
+                'input': fingerprint(os.path.join(indir, user)),
+                'reports': new,
+            }
+
+        # Render the reports, in parallel.
+        print('Rendering %d reports for %d users...' % (len(jobs), len(todo)))
+        errors = [e for e in pool.map(render_report, jobs) if e is not None]
+    finally:
+        pool.close()
+        pool.join()
+
+    for e in errors:
+        print('Failed to render %s' % e)
+    failed = set(e.split(':', 1)[0] for e in errors)
+    for user, stamps in allstamps.items():
+        if user not in failed:
+            save_stamps(os.path.join(outdir, user), stamps)
+    return len(errors)
+
+def unchanged(stamps, userindir, userdir, kinds, formats):
+    """
+    Returns True if a user's reports, as recorded by the given stamps (see
+    load_stamps()), are up-to-date with the .tcx files in userindir and all
+    exist in userdir.
+    """
+    return (stamps.get('version') == REPORT_VERSION and
+            stamps.get('kinds') == sorted(kinds) and
+            stamps.get('formats') == sorted(formats) and
+            stamps.get('input') == fingerprint(userindir) and
+            all(os.path.exists(os.path.join(userdir, 'pace-%s.%s' % (name, f)))
+                for name in stamps.get('reports', {}) for f in formats))
+
+def report_stamp(timestamps, y, dy):
+    """
+    Returns a hash of the data plotted in one report.
+    """
+    h = hashlib.sha1(str(REPORT_VERSION).encode('utf8'))
+    for a in (timestamps, y, dy):
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+def load_stamps(userdir):
+    try:
+        with open(os.path.join(userdir, 'reports.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def save_stamps(userdir, stamps):
+    with open(os.path.join(userdir, 'reports.json'), 'w') as f:
+        json.dump(stamps, f, indent = 2, sort_keys = True)
+
 if __name__ == "__main__":
-    print 'Guinea pigs, that is!\n'
-    print "                             ,   ,        "
-    print "                              \  |  \ / / / /"
-    print "                              / o   ,)       \\"
-    print "                            C      /     /  \\"
-    print "                              \_         (  /"
-    print "                               mm --- mooo-\n"
+    print('Guinea pigs, that is!\n')
+    print(r"                             ,   ,        ")
+    print(r"                              \  |  \ / / / /")
+    print("                              / o   ,)       \\")
+    print("                            C      /     /  \\")
+    print(r"                              \_         (  /")
+    print("                               mm --- mooo-\n")
 
     parser = argparse.ArgumentParser(description = 'Gaussian Processes on GC',
         epilog = 'guinea pig = gp',
@@ -104,6 +330,30 @@ if __name__ == "__main__":
         help = 'Input directory, contains lots of .tcx files.')
     parser.add_argument('-o', '--output', required = False,
         default = None, help = 'Output directory.')
+    parser.add_argument('-b', '--batch', action = 'store_true',
+        help = 'Batch mode: input directory contains one directory of .tcx '
+               'files per user (as created by download.py). Requires -o.')
+    parser.add_argument('-p', '--periods', default = 'all',
+        help = 'Batch mode: comma-separated periods to report on; any of '
+               'all, year, month (default: all).')
+    parser.add_argument('-f', '--formats', default = 'png',
+        help = 'Comma-separated output formats; any of png, svg, html '
+               '(default: png).')
+    parser.add_argument('-j', '--processes', type = int, default = None,
+        help = 'Batch mode: number of rendering processes (default: #CPUs).')
+    parser.add_argument('--force', action = 'store_true',
+        help = 'Batch mode: re-render reports even if data is unchanged.')
 
     args = vars(parser.parse_args())
-    main(args['input'], args['output'])
+    formats = [f for f in args['formats'].split(',') if f]
+    if args['batch']:
+        if args['output'] is None:
+            parser.error('--batch requires --output')
+        kinds = [p for p in args['periods'].split(',') if p]
+        for kind in kinds:
+            if kind not in ('all', 'year', 'month'):
+                parser.error('Unknown period: %s' % kind)
+        failed = batch(args['input'], args['output'], kinds, formats,
+                       args['processes'], args['force'])
+        raise SystemExit(1 if failed else 0)
+    raise SystemExit(main(args['input'], args['output'], formats))
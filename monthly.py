@@ -14,8 +14,6 @@ import argparse
 import json
 import datetime
 import base64
-import mechanize as me
-import tweepy
 
 LOGIN = "https://sso.garmin.com/sso/login?service=http%%3A%%2F%%2Fconnect.garmin.com%%2Fpost-auth%%2Flogin&webhost=olaxpw-connect01.garmin.com&source=http%%3A%%2F%%2Fconnect.garmin.com%%2Fen-US%%2Fsignin&redirectAfterAccountLoginUrl=http%%3A%%2F%%2Fconnect.garmin.com%%2Fpost-auth%%2Flogin&redirectAfterAccountCreationUrl=http%%3A%%2F%%2Fconnect.garmin.com%%2Fpost-auth%%2Flogin&gauthHost=https%%3A%%2F%%2Fsso.garmin.com%%2Fsso&locale=en&id=gauth-widget&cssUrl=https%%3A%%2F%%2Fstatic.garmincdn.com%%2Fcom.garmin.connect%%2Fui%%2Fsrc-css%%2Fgauth-custom.css&clientId=GarminConnect&rememberMeShown=true&rememberMeChecked=false&createAccountShown=true&openCreateAccount=false&usernameShown=true&displayNameShown=false&consumeServiceTicket=false&initialFocus=true&embedWidget=false#"
 REDIRECT = "http://connect.garmin.com/post-auth/login"
@@ -32,8 +30,8 @@ ACTIVITIES = 'http://connect.garmin.com/proxy/activity-search-service-1.2/json/a
 #   import base64
 #   base64.b64encode("your_username")
 # and so forth to get the base64 username and password.
-USERNAME = base64.b64decode('')
-PASSWORD = base64.b64decode('')
+USERNAME = base64.b64decode('').decode('utf8')
+PASSWORD = base64.b64decode('').decode('utf8')
 
 # Authentication with Twitter.
 # Get these by signing into dev.twitter.com and creating an app for yourself.
@@ -109,6 +107,9 @@ def activities(agent, increment = 100):
     return [totalActivities, distance, calories]
 
 if __name__ == "__main__":
+    import mechanize as me
+    import tweepy
+
     parser = argparse.ArgumentParser(description = 'Garmin Monthly Statistics',
         epilog = 'Because DailyMile apparently can\'t handle the awesome!',
         add_help = 'How to use', prog = 'python monthly.py')
@@ -1,14 +1,79 @@
 import sys
 import xml.parsers.expat
-import matplotlib.pyplot as plot
 import numpy as np
+from dataclasses import dataclass, field
 from datetime import datetime
 import time
-from scipy import stats
+from typing import List, Optional
+
+@dataclass(slots = True)
+class Lap:
+    """
+    One lap (split) of an activity.
+    """
+    distance: float = 0.0  # meters
+    duration: float = 0.0  # seconds
+
+@dataclass(slots = True)
+class Samples:
+    """
+    Per-trackpoint recordings of an activity. Missing values are NaN.
+    """
+    time: np.ndarray  # seconds since the first trackpoint
+    hr: np.ndarray  # heart rate (bpm)
+    cadence: np.ndarray  # rpm / steps per minute (one foot)
+    distance: np.ndarray  # meters
+
+@dataclass(slots = True)
+class Run:
+    """
+    The parts of a .tcx file we care about: when it started, and its laps.
+    """
+    timestamp: Optional[int] = None  # seconds since the epoch
+    laps: List[Lap] = field(default_factory = list)
+    sport: Optional[str] = None
+    samples: Optional[Samples] = None  # only if parsed with trackpoints
+
+    @property
+    def distances(self) -> np.ndarray:
+        """
+        Lap distances (in meters).
+        """
+        return np.fromiter((lap.distance for lap in self.laps), float, len(self.laps))
+
+    @property
+    def times(self) -> np.ndarray:
+        """
+        Lap durations (in seconds).
+        """
+        return np.fromiter((lap.duration for lap in self.laps), float, len(self.laps))
+
+class _WrongSport(Exception):
+    pass
+
+def _number(s: str) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        return float('nan')
+
+# Trackpoint elements we record, and their index in GCFileParser.point.
+_TIME, _HR, _CADENCE, _DISTANCE = range(4)
 
 class GCFileParser:
+    """
+    Parses a .tcx file. Only activities of the given sport are parsed (any
+    sport if sport is None). Per-trackpoint samples (heart rate etc.) are
+    only collected if trackpoints is True, as they make up the bulk of the
+    file.
+    """
 
-    def __init__(self, filename, sport = 'Running'):
+    # Skip <Track> contents and stop at the first activity of the wrong
+    # sport. Only turned off to benchmark against the original algorithm.
+    Shortcuts = True
+
+    def __init__(self, filename: str, sport: Optional[str] = 'Running',
+                 trackpoints: bool = False):
         self.parser = xml.parsers.expat.ParserCreate()
         self.parser.buffer_text = True
         self.parser.StartElementHandler = self._startElement
@@ -17,47 +82,110 @@ class GCFileParser:
 
         self.filename = filename
         self.isSport = False
-        self.wrongSport = False
         self.isDistance = False
         self.isTime = False
         self.isTrack = False
         self.isId = False
-        self.splits = []
-        self.times = []
-        self.timestamp = None
+        self.wrongSport = False
+        self.run = Run()
+        self.lap: Optional[Lap] = None
 
         self.sport = sport
+        self.trackpoints = trackpoints
+        self.points: List[List[str]] = []
+        self.point: Optional[List[str]] = None
+        self.field: Optional[int] = None
+        self.isHeartRate = False
 
     def parse(self):
-        # Read the TCX file and parse it.
-        f = open(self.filename)
-        self.parser.ParseFile(f)
-        f.close()
+        """
+        Returns [timestamp, lap distances, lap times], or [None, None, None]
+        if this is not an activity of the wanted sport.
+        """
+        run = self.parse_run()
+        if run is None:
+            return [None, None, None]
+        return [run.timestamp, run.distances, run.times]
+
+    def parse_run(self) -> Optional[Run]:
+        """
+        Returns the parsed Run, or None if this is not an activity of the
+        wanted sport.
+        """
+        # Read the TCX file and parse it. Stop as soon as we know that this
+        # is the wrong sport.
+        try:
+            with open(self.filename, 'rb') as f:
+                self.parser.ParseFile(f)
+        except _WrongSport:
+            return None
 
         # All done!
-        if self.wrongSport is True:
-            return [None, None, None]
-        return [self.timestamp, np.array(self.splits), np.array(self.times)]
+        if self.wrongSport:
+            return None
+        if self.trackpoints:
+            self.run.samples = self._samples()
+        return self.run
+
+    def _samples(self) -> Samples:
+        # Convert all the recorded strings in one go.
+        points = [p for p in self.points if p[_TIME]]
+        times = np.array([p[_TIME].rstrip('Z') for p in points], dtype = 'datetime64[ms]')
+        if len(times):
+            seconds = (times - times[0]) / np.timedelta64(1, 's')
+        else:
+            seconds = np.zeros(0)
+
+        def column(i):
+            values = [p[i] or 'nan' for p in points]
+            try:
+                return np.array(values, dtype = float)
+            except ValueError:
+                # Some devices write garbage (e.g. "n/a"); treat as missing.
+                return np.array([_number(v) for v in values], dtype = float)
+
+        return Samples(seconds, column(_HR), column(_CADENCE), column(_DISTANCE))
 
     def _startElement(self, name, attrs):
         if name == 'Activity':
-            if attrs['Sport'] != self.sport:
+            if self.sport is not None and attrs['Sport'] != self.sport:
+                if self.Shortcuts:
+                    raise _WrongSport()
                 self.wrongSport = True
-            else:
-                self.isSport = True
-        elif self.isSport and name == 'TotalTimeSeconds':
+                return
+            self.isSport = True
+            self.run.sport = attrs['Sport']
+        elif not self.isSport:
+            return
+        elif name == 'Lap':
+            self.lap = Lap()
+        elif name == 'TotalTimeSeconds':
             self.isTime = True
-        elif self.isSport and name == 'DistanceMeters':
+        elif name == 'DistanceMeters':
             self.isDistance = True
-        elif self.isSport and name == 'Track':
+        elif name == 'Track':
+            # This is where the bulk of a .tcx file is. Unless we want the
+            # trackpoints, skip it as cheaply as possible.
             self.isTrack = True
-        elif self.isSport and name == 'Id':
+            if self.trackpoints:
+                self.parser.StartElementHandler = self._startTrackElement
+                self.parser.CharacterDataHandler = self._trackData
+            elif self.Shortcuts:
+                self.parser.StartElementHandler = None
+                self.parser.CharacterDataHandler = None
+            else:
+                return
+            self.parser.EndElementHandler = self._endTrackElement
+        elif name == 'Id':
             self.isId = True
 
     def _endElement(self, name):
         if name == 'Activity' and self.isSport:
             # Clean up.
             self.isSport = False
+        elif name == 'Lap' and self.lap is not None:
+            self.run.laps.append(self.lap)
+            self.lap = None
         elif name == 'TotalTimeSeconds':
             self.isTime = False
         elif name == 'DistanceMeters':
@@ -67,17 +195,50 @@ class GCFileParser:
         elif name == 'Id':
             self.isId = False
 
+    def _startTrackElement(self, name, attrs):
+        if name == 'Trackpoint':
+            self.point = ['', '', '', '']
+        elif name == 'Time':
+            self.field = _TIME
+        elif name == 'HeartRateBpm':
+            self.isHeartRate = True
+        elif name == 'Value' and self.isHeartRate:
+            self.field = _HR
+        elif name == 'Cadence' or name.endswith('RunCadence'):
+            self.field = _CADENCE
+        elif name == 'DistanceMeters':
+            self.field = _DISTANCE
+
+    def _trackData(self, data):
+        if self.field is not None and self.point is not None:
+            self.point[self.field] = data
+
+    def _endTrackElement(self, name):
+        self.field = None
+        if name == 'Trackpoint' and self.point is not None:
+            self.points.append(self.point)
+            self.point = None
+        elif name == 'HeartRateBpm':
+            self.isHeartRate = False
+        elif name == 'Track':
+            self.isTrack = False
+            self.parser.StartElementHandler = self._startElement
+            self.parser.EndElementHandler = self._endElement
+            self.parser.CharacterDataHandler = self._characterData
+
     def _characterData(self, data):
         if self.isTime:
-            self.times.append(float(data))
+            if self.lap is not None:
+                self.lap.duration = float(data)
         elif self.isDistance and not self.isTrack:
-            self.splits.append(float(data))
+            if self.lap is not None:
+                self.lap.distance = float(data)
         elif self.isId:
-            self.timestamp = int(time.mktime(datetime.strptime(data, "%Y-%m-%dT%H:%M:%S.000Z").timetuple()))
+            self.run.timestamp = int(time.mktime(datetime.strptime(data, "%Y-%m-%dT%H:%M:%S.000Z").timetuple()))
 
 if __name__ == '__main__':
     analyze = GCFileParser(sys.argv[1])
     ts, distances, times = analyze.parse()
-    print distances
-    print times
-    print ts
+    print(distances)
+    print(times)
+    print(ts)
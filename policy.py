@@ -0,0 +1,183 @@
+from datetime import datetime
+import json
+
+
+class FileTypePolicy:
+    """Decide which files to download for each Garmin Connect activity.
+
+    A policy consists of a default set of file types, plus an ordered list of
+    per-activity-type rules that override the default. The first rule whose
+    activity type matches wins. In addition, activities may be restricted to a
+    set of activity types and/or a date range, and individual files may be
+    skipped when the server reports them to be larger than a given size.
+
+    Activity types are Garmin Connect's type keys (e.g. 'running'). A type
+    also matches its subtypes (e.g. 'trail_running', 'treadmill_running'), as
+    given by the 'parent' of the activity's type; rules for the subtype itself
+    take precedence over rules for its parent.
+
+    The JSON summary is always downloaded for activities that pass the filter,
+    as the local store is indexed by those files.
+    """
+
+    # File types downloaded when no other policy is given.
+    Default = ['orig.zip', 'tcx', 'gpx', 'kml', 'csv']
+
+    DateFormat = '%Y-%m-%d'
+
+    def __init__(self, default=None, rules=None, types=None,
+                 since=None, until=None, max_size=None):
+        self.default = list(self.Default if default is None else default)
+        self.rules = list(rules or [])  # [(activity type, [file types])]
+        self.types = set(types or [])  # empty -> all activity types
+        self.since = since  # datetime or None
+        self.until = until  # datetime or None
+        self.max_size = max_size  # bytes or None
+
+    @classmethod
+    def parse_date(cls, s):
+        return datetime.strptime(s, cls.DateFormat)
+
+    @staticmethod
+    def parse_filetypes(s):
+        """Parse a comma-separated list of file types ('' -> none)."""
+        return [t.strip() for t in s.split(',') if t.strip()]
+
+    @classmethod
+    def parse_rule(cls, s):
+        """Parse a rule of the form 'ACTIVITYTYPE=FILETYPE[,FILETYPE...]'."""
+        try:
+            activity_type, filetypes = s.split('=', 1)
+        except ValueError:
+            raise ValueError('Malformed rule "{}"'.format(s))
+        return activity_type.strip().lower(), cls.parse_filetypes(filetypes)
+
+    @classmethod
+    def from_config(cls, f):
+        """Load a policy from a JSON file object, e.g.:
+
+            {
+                "default": ["tcx"],
+                "rules": {"cycling": ["orig.zip"], "running": ["tcx"]},
+                "types": ["running", "cycling"],
+                "since": "2015-01-01",
+                "until": "2016-01-01",
+                "max_size": 10000000
+            }
+
+        All keys are optional. Rules are tried in sorted order of activity type.
+        """
+        config = json.load(f)
+        kwargs = {}
+        if 'default' in config:
+            kwargs['default'] = config['default']
+        if 'rules' in config:
+            kwargs['rules'] = [(k.lower(), v)
+                               for k, v in sorted(config['rules'].items())]
+        if 'types' in config:
+            kwargs['types'] = [t.lower() for t in config['types']]
+        for key in ['since', 'until']:
+            if config.get(key):
+                kwargs[key] = cls.parse_date(config[key])
+        if config.get('max_size'):
+            kwargs['max_size'] = int(config['max_size'])
+        return cls(**kwargs)
+
+    def update(self, default=None, rules=None, types=None,
+               since=None, until=None, max_size=None):
+        """Override parts of this policy (e.g. from command-line options).
+
+        Rules given here take precedence over existing rules."""
+        if default is not None:
+            self.default = list(default)
+        if rules:
+            self.rules = list(rules) + self.rules
+        if types:
+            self.types = set(types)
+        if since is not None:
+            self.since = since
+        if until is not None:
+            self.until = until
+        if max_size is not None:
+            self.max_size = max_size
+
+    def validate(self, known_filetypes):
+        """Raise ValueError if this policy refers to unknown file types."""
+        used = set(self.default)
+        for _, filetypes in self.rules:
+            used.update(filetypes)
+        unknown = used - set(known_filetypes)
+        if unknown:
+            raise ValueError('Unknown file type(s): {}'.format(
+                ', '.join(sorted(unknown))))
+
+    @staticmethod
+    def activity_type(activity):
+        """Return the (lowercase) activity type key of a raw activity dict."""
+        what = activity.get('activityType', {})
+        return (what.get('key') or what.get('display') or '').lower()
+
+    @classmethod
+    def activity_types(cls, activity):
+        """Return the (lowercase) type key of a raw activity dict, followed
+        by the key of its parent type, if any."""
+        types = [cls.activity_type(activity)]
+        parent = activity.get('activityType', {}).get('parent') or {}
+        parent = (parent.get('key') or parent.get('display') or '').lower()
+        if parent and parent not in types:
+            types.append(parent)
+        return types
+
+    @staticmethod
+    def activity_time(activity):
+        """Return the start time of a raw activity dict, or None."""
+        try:
+            return datetime.strptime(
+                activity['activitySummary']['BeginTimestamp']['value'],
+                '%Y-%m-%dT%H:%M:%S.000Z')
+        except (KeyError, ValueError):
+            return None
+
+    def wants(self, activity):
+        """Return True iff the given raw activity dict passes the filter."""
+        if self.types and self.types.isdisjoint(self.activity_types(activity)):
+            return False
+        if self.since is not None or self.until is not None:
+            when = self.activity_time(activity)
+            if when is None:
+                return True  # Cannot tell; err on the side of downloading
+            if self.since is not None and when < self.since:
+                return False
+            if self.until is not None and when >= self.until:
+                return False
+        return True
+
+    def filetypes(self, activity):
+        """Return the file types (excl. 'json') to get for the given activity.
+
+        Returns an empty list if the activity does not pass the filter."""
+        if not self.wants(activity):
+            return []
+        for what in self.activity_types(activity):
+            for activity_type, filetypes in self.rules:
+                if activity_type == what:
+                    return [t for t in filetypes if t != 'json']
+        return [t for t in self.default if t != 'json']
+
+    def search_params(self):
+        """Return activity-search query parameters for server-side filtering.
+
+        Returns a list of (key, value) pairs. Note that Garmin Connect uses
+        'beginTimestamp>' and 'beginTimestamp<' as parameter names to express
+        a date range, hence these cannot be passed through urlencode().
+        """
+        params = []
+        if len(self.types) == 1:
+            params.append(('activityType', list(self.types)[0]))
+        if self.since is not None:
+            params.append(('beginTimestamp>',
+                           self.since.strftime(self.DateFormat)))
+        if self.until is not None:
+            params.append(('beginTimestamp<',
+                           self.until.strftime(self.DateFormat)))
+        return params
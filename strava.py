@@ -1,13 +1,10 @@
-#!/usr/bin/env python2
-
-from __future__ import print_function
+#!/usr/bin/env python3
 
 from datetime import datetime
 import os
-import gpxpy
 
 
-class Activity(object):
+class Activity:
     def __init__(self, gpx_path):
         self.path = gpx_path
         fname = os.path.splitext(os.path.basename(self.path))[0]
@@ -15,15 +12,13 @@ class Activity(object):
         self.when = datetime.strptime(date + time, '%Y%m%d%H%M%S')
         self._gpx = None
 
-    def __unicode__(self):
-        return u'{} {}: {}'.format(self.when, self.what, self.name)
-
     def __str__(self):
-        return unicode(self).encode('utf8')
+        return '{} {}: {}'.format(self.when, self.what, self.name)
 
     @property
     def gpx(self):
         if self._gpx is None:
+            import gpxpy
             with open(self.path) as f:
                 self._gpx = gpxpy.parse(f)
         return self._gpx
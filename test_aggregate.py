@@ -0,0 +1,103 @@
+from datetime import date
+import os
+import sys
+
+import pytest
+
+import aggregate
+
+
+def buckets(aggregator):
+    return {kind: {group: {key: aggregator.buckets[kind][group][key].summary()
+                           for key in keys}
+                   for group, keys in groups.items()}
+            for kind, groups in aggregator.buckets.items()}
+
+
+@pytest.fixture
+def store(store, write_activity):
+    write_activity(1, '2015-01-30', km=10.0, seconds=3000.0)
+    write_activity(2, '2015-01-31', km=5.0, seconds=1800.0)
+    write_activity(3, '2015-02-01', sport='Cycling', km=40.0)
+    return store
+
+
+def test_bucket_keys():
+    day = date(2015, 1, 30)
+    assert aggregate.bucket_keys('week', day) == ['2015-W05']
+    assert aggregate.bucket_keys('month', day) == ['2015-01']
+    assert aggregate.bucket_keys('3d', day) == [
+        '2015-01-30', '2015-01-31', '2015-02-01']
+
+
+def test_bucket_counts(store):
+    aggregator = aggregate.Aggregator(store, ['month', '2d'])
+    assert aggregator.update() == 3
+    months = dict(aggregator.summary('month'))
+    assert months['2015-01']['count'] == 2
+    assert months['2015-01']['distance'] == 15000.0
+    assert months['2015-02']['count'] == 1
+    assert [k for k, _ in aggregator.summary('month', 'running')] == [
+        '2015-01']
+    windows = {k: s['count'] for k, s in aggregator.summary('2d')}
+    assert windows == {'2015-01-30': 1, '2015-01-31': 2, '2015-02-01': 2}
+    assert '2015-02-02' in aggregator.buckets['2d'][aggregate.AllTypes]
+    windows = [k for k, _ in aggregator.summary('2d', 'running')]
+    assert windows == ['2015-01-30', '2015-01-31']
+
+
+def test_rolling_windows_until(store):
+    aggregator = aggregate.Aggregator(store, ['28d'])
+    aggregator.update()
+    windows = aggregator.summary('28d', until=date(2015, 1, 31))
+    assert [k for k, _ in windows] == ['2015-01-30', '2015-01-31']
+    assert aggregator.summary('28d')[-1][0] == '2015-02-01'
+
+
+def test_remove_pace(store):
+    aggregator = aggregate.Aggregator(store, ['month'])
+    aggregator.update()
+    bucket = aggregator.buckets['month']['running']['2015-01']
+    assert bucket.paces == [300.0, 360.0]
+    assert aggregator.remove(2)
+    assert bucket.paces == [300.0]
+    assert bucket.count == 1
+    assert aggregator.remove(1)
+    assert '2015-01' not in aggregator.buckets['month']['running']
+    assert not aggregator.remove(1)
+
+
+def test_incremental_matches_rebuild(store, write_activity):
+    aggregator = aggregate.Aggregator(store, ['week', '7d'])
+    aggregator.update()
+    os.remove(store.path('2.json'))
+    write_activity(1, '2015-01-29', km=12.0)
+    write_activity(4, '2015-03-01', sport='Swimming', km=1.0)
+    assert aggregate.Aggregator(store, ['week', '7d']).update() == 3
+
+    incremental = aggregate.Aggregator(store, ['week', '7d'])
+    os.remove(store.path(aggregate.Aggregator.Filename))
+    rebuilt = aggregate.Aggregator(store, ['week', '7d'])
+    rebuilt.update()
+    assert buckets(incremental) == buckets(rebuilt)
+
+
+def test_unknown_unit(store, write_activity):
+    write_activity(4, '2015-02-02', km=3.0, uom='furlong')
+    aggregator = aggregate.Aggregator(store, ['month'])
+    with pytest.warns(UserWarning, match='furlong'):
+        assert aggregator.update() == 4
+    assert dict(aggregator.summary('month'))['2015-02']['count'] == 2
+
+
+def test_main_prints_requested_kinds(store, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['aggregate.py', '-d', store.basedir,
+                                      '-b', 'year'])
+    aggregate.main()
+    monkeypatch.setattr(sys, 'argv', ['aggregate.py', '-d', store.basedir,
+                                      '-b', 'week'])
+    capsys.readouterr()
+    aggregate.main()
+    headers = [line.split()[0] for line in capsys.readouterr().out.splitlines()
+               if line.endswith('p90')]
+    assert headers == ['week']
@@ -0,0 +1,126 @@
+import json
+import os
+
+import mechanize
+import pytest
+
+import download
+from policy import FileTypePolicy
+
+
+class FakeRemote:
+    """Stands in for GarminScraper, serving activities from memory."""
+
+    filename = download.GarminScraper.filename
+
+    def __init__(self, activities, fail_after=None):
+        self.items = activities
+        self.fail_after = fail_after  # Raise after this many activities
+        self.downloads = []
+
+    def activities(self, limit=None, params=()):
+        self.params = list(params)
+        types = [value for key, value in params if key == 'activityType']
+        for i, activity in enumerate(self.items):
+            if i == self.fail_after:
+                raise IOError('Connection reset')
+            if not types or activity['activityType']['key'] in types:
+                yield activity
+
+    def download(self, activity, filetype, max_size=None):
+        self.downloads.append(self.filename(activity, filetype))
+        if filetype == 'json':
+            return json.dumps(activity, sort_keys=True).encode('utf8')
+        return '{} {}'.format(activity['activityId'], filetype).encode('utf8')
+
+
+@pytest.fixture
+def remote(make_activity):
+    return FakeRemote([make_activity(i) for i in (3, 2, 1)])
+
+
+def test_redownload(store, remote):
+    policy = FileTypePolicy(default=['tcx'])
+    download.sync(remote, store, policy)
+    store.enqueue(['2.tcx'])
+    remote.downloads = []
+    download.sync(remote, store, policy, stop_after=1)
+    assert remote.downloads == ['2.tcx', '3.json']
+    assert store.queued() == []
+
+
+def test_redownload_missing_json(store, remote):
+    policy = FileTypePolicy(default=['tcx'])
+    download.sync(remote, store, policy)
+    os.remove(store.path('2.json'))  # As done by fsck.py --repair
+    store.enqueue(['2.tcx'])
+    download.redownload(remote, store, policy)
+    assert store.queued() == ['2.json', '2.tcx']
+
+    # The queued JSON forces a full sync, which gets both files.
+    remote.downloads = []
+    download.sync(remote, store, policy, stop_after=1)
+    assert '2.json' in store and '2.tcx' in store
+    assert store.queued() == []
+    assert len(remote.downloads) == 4
+
+
+def test_redownload_interrupted(store, remote):
+    policy = FileTypePolicy(default=['tcx'])
+    download.sync(remote, store, policy)
+    store.enqueue(['1.json'])
+    with pytest.raises(IOError):
+        download.sync(FakeRemote(remote.items, fail_after=1), store, policy)
+    assert store.queued() == ['1.json']
+    download.sync(remote, store, policy)
+    assert store.queued() == []
+
+
+def test_redownload_gone(store, remote):
+    policy = FileTypePolicy(default=['tcx'])
+    download.sync(remote, store, policy)
+    store.enqueue(['4.json', '4.tcx'])
+    download.sync(remote, store, policy, stop_after=1)
+    assert store.queued() == []
+
+
+def test_http_error_skips_file(store, remote):
+    def flaky_download(activity, filetype, max_size=None):
+        if (activity['activityId'], filetype) == (2, 'tcx'):
+            raise mechanize.HTTPError('url', 500, 'Server Error', {}, None)
+        return FakeRemote.download(remote, activity, filetype, max_size)
+
+    remote.download = flaky_download
+    policy = FileTypePolicy(default=['tcx'])
+    assert len(download.sync(remote, store, policy)) == 3
+    assert '1.tcx' in store and '2.tcx' not in store
+
+
+def test_redownload_unwanted(store, remote):
+    download.sync(remote, store, FileTypePolicy(default=['tcx', 'gpx']))
+    os.remove(store.path('2.gpx'))
+    store.enqueue(['2.gpx', '3.gpx'])
+    remote.downloads = []
+    download.sync(remote, store, FileTypePolicy(default=['tcx']),
+                  stop_after=1)
+    assert remote.downloads == ['3.json']
+    assert store.queued() == []
+    assert '2.gpx' not in store
+
+
+def test_full_sync_keeps_filtered_activities(store, make_activity):
+    remote = FakeRemote([make_activity(2, sport='Cycling'),
+                         make_activity(1)])
+    policy = FileTypePolicy(default=['tcx'], types=['running'])
+    download.sync(remote, store, policy)
+    assert remote.params == [('activityType', 'running')]
+
+    # A queued JSON forces a full sync, which lists all activities. Files
+    # of activities the policy excludes are dropped, but not as "gone".
+    store.enqueue(['1.json', '2.json', '3.json'])
+    os.remove(store.path('1.json'))
+    download.sync(remote, store, policy)
+    assert remote.params == []
+    assert '1.json' in store and '2.json' not in store
+    assert store.queued() == []
+
@@ -0,0 +1,44 @@
+import os
+
+import fsck
+from policy import FileTypePolicy
+
+
+def problems(store, policy=None):
+    return sorted((os.path.basename(p.path), p.kind)
+                  for p in fsck.scan(store.basedir, policy, threads=2))
+
+
+def test_policy_filetypes(store, write_activity):
+    write_activity(1, sport='Running')
+    write_activity(2, sport='Cycling')
+    store.write('1.tcx', b'<TrainingCenterDatabase></TrainingCenterDatabase>')
+    policy = FileTypePolicy(default=['tcx'], rules=[('cycling', ['orig.zip'])])
+    assert problems(store, policy) == [('2.orig.zip', 'missing')]
+
+    policy.update(types=['running'])  # Cycling activities are not wanted
+    assert problems(store, policy) == []
+
+
+def test_corrupt_json(store, write_activity):
+    policy = FileTypePolicy(default=[])
+    for activity_id, data in [(1, b'[]'), (2, b'"x"'), (3, b'null'),
+                              (4, b'{"activityId": ')]:
+        store.write('{}.json'.format(activity_id), data)
+    write_activity(5)
+    assert problems(store, policy) == [
+        ('1.json', 'corrupt'), ('2.json', 'corrupt'), ('3.json', 'corrupt'),
+        ('4.json', 'corrupt')]
+
+
+def test_repair(store, write_activity):
+    write_activity(1)
+    store.write('1.tcx', b'<TrainingCenterDatabase>')  # Truncated
+    store.write('2.gpx', b'<gpx></gpx>')
+    policy = FileTypePolicy(default=['tcx', 'gpx'])
+    found = fsck.scan(store.basedir, policy)
+    assert sorted((os.path.basename(p.path), p.kind) for p in found) == [
+        ('1.gpx', 'missing'), ('1.tcx', 'truncated'), ('2.gpx', 'orphan')]
+    assert fsck.repair(found) == 2
+    assert store.queued() == ['1.gpx', '1.tcx']
+    assert '1.tcx' not in store
@@ -0,0 +1,62 @@
+import os
+import shutil
+import time
+
+import numpy as np
+
+import gp
+
+
+def local(*when):
+    return time.mktime(when + (0, 0, 0, 0, 0, -1))
+
+
+def test_periods():
+    timestamps = np.array([local(2014, 12, 31), local(2015, 1, 1),
+                           local(2015, 1, 20), local(2015, 3, 5)])
+    (name, mask), = gp.periods(timestamps, 'all')
+    assert name == 'all' and mask.all()
+    years = gp.periods(timestamps, 'year')
+    assert [name for name, _ in years] == ['2014', '2015']
+    assert years[1][1].tolist() == [False, True, True, True]
+    months = gp.periods(timestamps, 'month')
+    assert [name for name, _ in months] == ['2014-12', '2015-01', '2015-03']
+    assert months[1][1].tolist() == [False, True, True, False]
+
+
+def test_unchanged(tmp_path, testdata):
+    indir, outdir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    os.makedirs(indir)
+    os.makedirs(outdir)
+    shutil.copy(testdata('running.tcx'), os.path.join(indir, '1.tcx'))
+    with open(os.path.join(outdir, 'pace-all.png'), 'w') as f:
+        f.write('png')
+    gp.save_stamps(outdir, {
+        'version': gp.REPORT_VERSION,
+        'kinds': ['all'],
+        'formats': ['png'],
+        'input': gp.fingerprint(indir),
+        'reports': {'all': 'hash'},
+    })
+    stamps = gp.load_stamps(outdir)
+    assert gp.unchanged(stamps, indir, outdir, ['all'], ['png'])
+    assert not gp.unchanged(stamps, indir, outdir, ['all', 'year'], ['png'])
+    assert not gp.unchanged(stamps, indir, outdir, ['all'], ['png', 'svg'])
+
+    os.remove(os.path.join(outdir, 'pace-all.png'))
+    assert not gp.unchanged(stamps, indir, outdir, ['all'], ['png'])
+    with open(os.path.join(outdir, 'pace-all.png'), 'w') as f:
+        f.write('png')
+
+    shutil.copy(testdata('biking.tcx'), os.path.join(indir, '2.tcx'))
+    assert not gp.unchanged(stamps, indir, outdir, ['all'], ['png'])
+
+
+def test_report_stamp():
+    t, y, dy = np.array([1.0, 2.0]), np.array([8.0, 9.0]), np.array([0.1, 0.2])
+    assert gp.report_stamp(t, y, dy) == gp.report_stamp(t.copy(), y, dy)
+    assert gp.report_stamp(t, y, dy) != gp.report_stamp(t, y + 1, dy)
+
+
+def test_load_stamps_missing(tmp_path):
+    assert gp.load_stamps(str(tmp_path)) == {}
@@ -0,0 +1,58 @@
+import time
+
+import numpy as np
+import pytest
+
+import parser as gcparser
+
+# Output of the original (Python 2) parser for testdata/running.tcx. The
+# <Id> is interpreted as local time, so the timestamp depends on the TZ.
+Timestamp = int(time.mktime((2015, 6, 7, 8, 30, 0, 0, 0, -1)))
+Distances = [1000.0, 1000.0, 412.7]
+Times = [301.5, 295.25, 130.0]
+
+
+@pytest.fixture(params=[True, False], ids=['shortcuts', 'no-shortcuts'])
+def shortcuts(request, monkeypatch):
+    monkeypatch.setattr(gcparser.GCFileParser, 'Shortcuts', request.param)
+
+
+def test_parse_matches_baseline(shortcuts, testdata):
+    ts, distances, times = gcparser.GCFileParser(
+        testdata('running.tcx')).parse()
+    assert ts == Timestamp
+    np.testing.assert_array_equal(distances, Distances)
+    np.testing.assert_array_equal(times, Times)
+
+
+def test_parse_wrong_sport(shortcuts, testdata):
+    result = gcparser.GCFileParser(testdata('biking.tcx')).parse()
+    assert result == [None, None, None]
+
+
+def test_parse_any_sport(shortcuts, testdata):
+    run = gcparser.GCFileParser(
+        testdata('biking.tcx'), sport=None).parse_run()
+    assert run.sport == 'Biking'
+    np.testing.assert_array_equal(run.distances, Distances)
+
+
+def test_parse_trackpoints(testdata):
+    run = gcparser.GCFileParser(
+        testdata('running.tcx'), trackpoints=True).parse_run()
+    np.testing.assert_array_equal(run.distances, Distances)
+    assert len(run.samples.time) == 12
+    assert run.samples.time[0] == 0.0
+    np.testing.assert_array_equal(run.samples.hr[:4], [140, 141, 142, 143])
+    np.testing.assert_array_equal(run.samples.cadence[:4], [84, 85, 86, 87])
+    assert run.samples.distance[-1] == pytest.approx(2412.7, abs=0.1)
+
+
+def test_parse_trackpoints_bad_values(tmp_path, testdata):
+    with open(testdata('running.tcx')) as f:
+        tcx = f.read()
+    path = tmp_path / 'bad.tcx'
+    path.write_text(tcx.replace('<Value>141</Value>', '<Value>n/a</Value>'))
+    run = gcparser.GCFileParser(str(path), trackpoints=True).parse_run()
+    np.testing.assert_array_equal(
+        run.samples.hr[:4], [140, np.nan, 142, 143])
@@ -0,0 +1,101 @@
+from datetime import datetime
+import io
+import json
+
+import pytest
+
+from download import GarminScraper
+from policy import FileTypePolicy
+
+Config = {
+    'default': ['tcx'],
+    'rules': {'running': ['tcx', 'gpx'], 'cycling': ['orig.zip']},
+    'types': ['Running', 'cycling'],
+    'since': '2015-01-01',
+    'max_size': 1000,
+}
+
+
+def activity(key, day='2015-06-07', parent=None):
+    what = {'key': key, 'display': key.title()}
+    if parent is not None:
+        what['parent'] = {'key': parent, 'display': parent.title()}
+    return {
+        'activityId': 1,
+        'activityType': what,
+        'activitySummary': {
+            'BeginTimestamp': {'value': day + 'T07:00:00.000Z'}},
+    }
+
+
+def test_search_query():
+    policy = FileTypePolicy(types=['running'], since=datetime(2015, 1, 1),
+                            until=datetime(2016, 1, 1))
+    assert GarminScraper.search_query(policy.search_params()) == (
+        '&activityType=running'
+        '&beginTimestamp>2015-01-01&beginTimestamp<2016-01-01')
+    assert GarminScraper.search_query([('q', 'a b&c')]) == '&q=a+b%26c'
+    assert GarminScraper.search_query([]) == ''
+
+
+def test_from_config():
+    policy = FileTypePolicy.from_config(io.StringIO(json.dumps(Config)))
+    assert policy.default == ['tcx']
+    assert policy.rules == [('cycling', ['orig.zip']),
+                            ('running', ['tcx', 'gpx'])]
+    assert policy.types == {'running', 'cycling'}
+    assert policy.since == datetime(2015, 1, 1)
+    assert policy.until is None
+    assert policy.max_size == 1000
+
+
+def test_update_precedence():
+    policy = FileTypePolicy.from_config(io.StringIO(json.dumps(Config)))
+    policy.update(rules=[('running', ['csv'])], until=datetime(2016, 1, 1))
+    assert policy.filetypes(activity('running')) == ['csv']
+    assert policy.filetypes(activity('cycling')) == ['orig.zip']
+    assert policy.default == ['tcx']  # Not given -> kept
+    assert policy.max_size == 1000
+    assert policy.until == datetime(2016, 1, 1)
+
+    policy.update(default=[], types=['swimming'])
+    assert policy.default == []
+    assert policy.types == {'swimming'}
+
+
+def test_validate():
+    policy = FileTypePolicy(default=['tcx'], rules=[('cycling', ['fit'])])
+    with pytest.raises(ValueError, match='fit'):
+        policy.validate(GarminScraper.FileType)
+    FileTypePolicy(rules=[('cycling', ['orig.zip'])]).validate(
+        GarminScraper.FileType)
+
+
+def test_wants_dates():
+    policy = FileTypePolicy(since=datetime(2015, 1, 1),
+                            until=datetime(2016, 1, 1))
+    assert not policy.wants(activity('running', '2014-12-31'))
+    assert policy.wants(activity('running', '2015-01-01'))
+    assert policy.wants(activity('running', '2015-12-31'))
+    assert not policy.wants(activity('running', '2016-01-01'))
+    assert policy.filetypes(activity('running', '2016-01-01')) == []
+    assert policy.wants({'activityType': {'key': 'running'}})  # No date
+
+
+def test_filetypes():
+    policy = FileTypePolicy(default=['tcx', 'json'],
+                            rules=[('cycling', ['orig.zip'])])
+    assert policy.filetypes(activity('running')) == ['tcx']
+    assert policy.filetypes(activity('cycling')) == ['orig.zip']
+
+
+def test_subtypes():
+    policy = FileTypePolicy(default=['tcx'], types=['running', 'cycling'],
+                            rules=[('cycling', ['orig.zip']),
+                                   ('mountain_biking', ['gpx'])])
+    assert policy.wants(activity('trail_running', parent='running'))
+    assert not policy.wants(activity('lap_swimming', parent='swimming'))
+    assert policy.filetypes(activity('road_biking', parent='cycling')) == [
+        'orig.zip']
+    assert policy.filetypes(
+        activity('mountain_biking', parent='cycling')) == ['gpx']
@@ -0,0 +1,144 @@
+from datetime import date
+import math
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from garmin import GarminStore
+import parser as gcparser
+import training
+
+
+def test_extract(tmp_path, testdata):
+    tcx = str(tmp_path / '1.tcx')
+    shutil.copy(testdata('running.tcx'), tcx)
+    assert training.extract(tcx)
+    samples = training.load_samples(str(tmp_path / '1.samples.npz'))
+    assert len(samples.time) == 12
+
+
+def test_extract_removes_stale_cache(tmp_path, testdata):
+    tcx = str(tmp_path / '1.tcx')
+    shutil.copy(testdata('running.tcx'), tcx)
+    assert training.extract(tcx)
+    with open(tcx, 'w') as f:
+        f.write('<TrainingCenterDatabase><Activities>')  # Truncated
+    assert not training.extract(tcx)
+    assert '1.samples.npz' not in GarminStore(str(tmp_path))
+
+
+def test_parse_zones():
+    assert training.parse_zones('120,140,160') == (120.0, 140.0, 160.0)
+    with pytest.raises(ValueError):
+        training.parse_zones('120,160,140')
+
+
+def test_metrics():
+    profile = training.HeartRateProfile(rest=50.0, max=150.0, threshold=150.0)
+    samples = gcparser.Samples(
+        np.array([0.0, 20.0, 40.0, 60.0]), np.full(4, 100.0),
+        np.array([80.0, 80.0, np.nan, 80.0]),
+        np.array([0.0, 200.0, 400.0, 600.0]))
+    result = training.metrics(samples, profile)
+    # 1 minute at half the heart rate reserve; threshold is max here.
+    trimp = 1 * 0.5 * 0.64 * math.exp(1.92 * 0.5)
+    assert result['duration'] == 60.0
+    assert result['trimp'] == pytest.approx(trimp)
+    assert result['tss'] == pytest.approx(
+        100 * trimp / (60 * 0.64 * math.exp(1.92)))
+    assert result['zones'] == [0.0, 60.0, 0.0, 0.0, 0.0]  # 90 < 100 < 105
+    assert result['avg_hr'] == 100.0
+    assert result['avg_cadence'] == 80.0
+    assert result['decoupling'] is None  # Too short
+
+
+def test_metrics_female_zones():
+    profile = training.HeartRateProfile(rest=50.0, max=150.0, threshold=150.0,
+                                        zones=(110.0, 130.0), female=True)
+    samples = gcparser.Samples(
+        np.array([0.0, 30.0, 60.0]), np.array([100.0, 140.0, 0.0]),
+        np.full(3, np.nan), np.full(3, np.nan))
+    result = training.metrics(samples, profile)
+    assert result['trimp'] == pytest.approx(
+        0.5 * (0.5 * 0.86 * math.exp(1.67 * 0.5) +
+               0.9 * 0.86 * math.exp(1.67 * 0.9)))
+    assert result['zones'] == [30.0, 0.0, 30.0]
+    assert result['avg_cadence'] is None
+
+
+def test_decoupling():
+    # 40 minutes at a steady heart rate, 10% slower in the second half.
+    t = np.arange(0.0, 2401.0, 10.0)
+    speed = np.where(t[:-1] < 1200, 30.0, 27.0)
+    d = np.concatenate([[0.0], np.cumsum(speed)])
+    samples = gcparser.Samples(
+        t, np.full(len(t), 120.0), np.full(len(t), 80.0), d)
+    result = training.metrics(samples, training.HeartRateProfile())
+    assert result['decoupling'] == pytest.approx(10.0)
+
+
+def test_fitness():
+    atl, ctl = training.fitness(np.array([70.0, 0.0]))
+    assert atl.tolist() == pytest.approx([10.0, 10.0 - 10.0 / 7])
+    assert ctl.tolist() == pytest.approx([70.0 / 42, 70.0 / 42 * 41 / 42])
+
+
+def test_compute_daily(store):
+    index = training.TrainingIndex(store)
+    index.activities = {
+        '1': {'date': '2015-06-01', 'tss': 50.0},
+        '2': {'date': '2015-06-01', 'tss': 20.0},
+        '3': {'date': '2015-06-03', 'tss': 42.0},
+        '4': {'tcx_mtime': 1.0},  # Unusable .tcx file
+    }
+    daily = index.compute_daily(until=date(2015, 6, 4))
+    assert [d['date'] for d in daily] == [
+        '2015-06-01', '2015-06-02', '2015-06-03', '2015-06-04']
+    assert [d['load'] for d in daily] == [70.0, 0.0, 42.0, 0.0]
+    assert daily[0] == {'date': '2015-06-01', 'load': 70.0, 'atl': 10.0,
+                        'ctl': 1.7, 'tsb': -8.3}
+
+
+def test_update(store, write_activity, testdata, monkeypatch):
+    write_activity(1, '2015-06-07')
+    shutil.copy(testdata('running.tcx'), store.path('1.tcx'))
+    write_activity(2, '2015-06-08')
+    with open(store.path('2.tcx'), 'w') as f:
+        f.write('<TrainingCenterDatabase><Activities>')  # Truncated
+    profile = training.HeartRateProfile()
+
+    index = training.TrainingIndex(store)
+    assert index.update(profile, processes=1, until=date(2015, 6, 8)) == 2
+    tss = index.activities['1']['tss']
+    assert tss > 0
+    assert 'tss' not in index.activities['2']
+    assert index.daily[-1]['date'] == '2015-06-08'
+
+    # Nothing changed: nothing to do, and no .tcx files are parsed.
+    def extract(tcx_path):
+        raise AssertionError('Parsed ' + tcx_path)
+
+    monkeypatch.setattr(training, 'extract', extract)
+    index = training.TrainingIndex(store)
+    assert index.update(profile, processes=1) == 0
+
+    # New zones: recomputed from the cached samples; 2.tcx is still skipped.
+    profile.threshold = 160.0
+    assert training.TrainingIndex(store).update(profile, processes=1) == 1
+    assert training.TrainingIndex(store).activities['1']['tss'] > tss
+
+    # 2.tcx fixed: parsed again.
+    monkeypatch.undo()
+    shutil.copy(testdata('running.tcx'), store.path('2.tcx'))
+    os.utime(store.path('2.tcx'), (1e9, 1e9))
+    index = training.TrainingIndex(store)
+    assert index.update(profile, processes=1) == 1
+    assert index.activities['2']['tss'] == index.activities['1']['tss']
+
+    # .tcx file removed: activity dropped.
+    os.remove(store.path('1.tcx'))
+    index = training.TrainingIndex(store)
+    index.update(profile, processes=1)
+    assert list(index.activities) == ['2']
@@ -0,0 +1,97 @@
+import random
+import shutil
+
+import pytest
+
+import aggregate
+from download import SessionExpired
+from policy import FileTypePolicy
+import training
+import watch
+
+
+class FakeScraper:
+    def __init__(self, username):
+        self.username = username
+
+
+@pytest.fixture
+def account(store, monkeypatch):
+    def login(account):
+        account.remote = FakeScraper(account.username)
+        account.logins += 1
+
+    monkeypatch.setattr(watch.Account, 'login', login)
+    return watch.Account('user', 'secret', store)
+
+
+def test_delay(account):
+    watcher = watch.Watcher([account], FileTypePolicy(), interval=100,
+                            jitter=0.0, max_backoff=1000)
+    delays = []
+    for failures in range(6):
+        account.failures = failures
+        delays.append(watcher.delay(account))
+    assert delays == [100, 200, 400, 800, 1000, 1000]
+
+    watcher.jitter = 0.1
+    random.seed(1)
+    account.failures = 0
+    delays = [watcher.delay(account) for _ in range(100)]
+    assert all(90 <= d <= 110 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_relogin_after_session_expired(account, monkeypatch):
+    calls = []
+
+    def sync(remote, local, policy, stop_after=None):
+        calls.append(remote)
+        if len(calls) == 1:
+            raise SessionExpired(remote.username)
+        return [{'activityId': 1}]
+
+    monkeypatch.setattr(watch, 'sync', sync)
+    watcher = watch.Watcher([account], FileTypePolicy())
+    assert watcher.poll(account) == [{'activityId': 1}]
+    assert account.logins == 2
+    assert calls[0] is not calls[1]
+
+
+def test_failure_keeps_session(account, monkeypatch):
+    def sync(remote, local, policy, stop_after=None):
+        raise IOError('Connection reset')
+
+    monkeypatch.setattr(watch, 'sync', sync)
+    watcher = watch.Watcher([account], FileTypePolicy())
+    watcher.poll_and_reschedule(account)
+    watcher.poll_and_reschedule(account)
+    assert account.failures == 2
+    assert account.logins == 1
+    assert account.last_error == 'OSError: Connection reset'
+
+
+def test_on_new_failure(account):
+    def on_new(account, activities):
+        raise RuntimeError('Disk full')
+
+    watcher = watch.Watcher([account], FileTypePolicy(), on_new=on_new)
+    watcher.poll = lambda account: [{'activityId': 1}]
+    assert watcher.poll_and_reschedule(account) > 0
+    assert account.failures == 0
+    assert account.downloaded == 1
+    assert account.last_error == 'on_new: RuntimeError: Disk full'
+
+
+def test_update_indexes(store, write_activity, testdata):
+    write_activity(1, '2015-06-07')
+    shutil.copy(testdata('running.tcx'), store.path('1.tcx'))
+    watch.update_indexes(store, training=True, kinds=['week'])
+    assert list(training.TrainingIndex(store).activities) == ['1']
+    assert aggregate.stored_kinds(store) == ['week']
+
+    write_activity(2, '2015-06-08')
+    watch.update_indexes(store, kinds=['month'])
+    assert aggregate.stored_kinds(store) == ['month', 'week']
+    assert dict(aggregate.Aggregator(store, ['month', 'week']).summary(
+        'month'))['2015-06']['count'] == 2
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Heart rate based training load for the activities in a GarminStore.
+
+For each activity with a .tcx file we compute:
+
+ - TRIMP: Banister's training impulse, from heart rate reserve.
+ - hrTSS: TRIMP relative to one hour at threshold heart rate (x 100).
+ - Time spent in each heart rate zone.
+ - Aerobic decoupling: the drop in efficiency (meters per heartbeat) from the
+   first to the second half of the activity, in percent.
+ - Average heart rate and cadence.
+
+Daily hrTSS is then smoothed into fatigue (acute training load, ATL), fitness
+(chronic training load, CTL) and form (training stress balance, TSB).
+
+Results are kept in training.json in the store, and only activities whose .tcx
+file has changed are recomputed. A .tcx file without a usable activity is
+recorded without metrics, and is not parsed again until it changes. The
+trackpoints of each activity are cached in <id>.samples.npz, so that
+recomputing the whole history after changing heart rate zones does not need to
+parse any .tcx files.
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import date
+import json
+import multiprocessing
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import xml.parsers.expat
+
+import numpy as np
+
+from garmin import Activity, GarminStore
+import parser as gcparser
+
+# Gaps between trackpoints longer than this (in seconds) are pauses.
+MaxGap = 30.0
+
+# Activities shorter than this (in seconds) get no aerobic decoupling.
+MinDecouplingTime = 20 * 60.0
+
+
+@dataclass(slots=True)
+class HeartRateProfile:
+    """The athlete's heart rate characteristics (in bpm)."""
+
+    rest: float = 50.0
+    max: float = 190.0
+    threshold: float = 170.0
+    # Upper bounds of all but the last zone; default: 60/70/80/90% of max.
+    zones: Tuple[float, ...] = ()
+    female: bool = False
+
+    def bounds(self) -> np.ndarray:
+        if self.zones:
+            return np.array(self.zones, dtype=float)
+        return self.max * np.array([0.6, 0.7, 0.8, 0.9])
+
+    def reserve(self, hr):
+        """Return the fraction of heart rate reserve used (0..1)."""
+        return np.clip((hr - self.rest) / (self.max - self.rest), 0.0, 1.0)
+
+    def trimp(self, hrr, minutes):
+        """Return Banister's TRIMP for the given heart rate reserve(s)."""
+        k1, k2 = (0.86, 1.67) if self.female else (0.64, 1.92)
+        return minutes * hrr * k1 * np.exp(k2 * hrr)
+
+    def settings(self) -> Dict[str, Any]:
+        settings = asdict(self)
+        settings['zones'] = list(self.zones)
+        return settings
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> 'HeartRateProfile':
+        profile = cls(**settings)
+        profile.zones = tuple(profile.zones)
+        return profile
+
+
+def load_samples(path: str) -> gcparser.Samples:
+    with np.load(path) as npz:
+        return gcparser.Samples(
+            npz['time'], npz['hr'], npz['cadence'], npz['distance'])
+
+
+def extract(tcx_path: str) -> bool:
+    """Parse trackpoints from a .tcx file into its .samples.npz cache file.
+
+    Returns False if the file contains no (well-formed) activity, in which
+    case any cache file left from an earlier version is removed."""
+    store = GarminStore(os.path.dirname(tcx_path))
+    filename = os.path.basename(tcx_path)[:-len('.tcx')] + '.samples.npz'
+    try:
+        run = gcparser.GCFileParser(
+            tcx_path, sport=None, trackpoints=True).parse_run()
+    except (xml.parsers.expat.ExpatError, ValueError):
+        run = None
+    if run is None or run.samples is None:
+        try:
+            os.remove(store.path(filename))
+        except FileNotFoundError:
+            pass
+        return False
+    with store.open(filename, 'w') as f:
+        np.savez(f, time=run.samples.time, hr=run.samples.hr,
+                 cadence=run.samples.cadence, distance=run.samples.distance)
+    return True
+
+
+def metrics(samples: gcparser.Samples,
+            profile: HeartRateProfile) -> Dict[str, Any]:
+    """Compute the training load metrics of one activity."""
+    t = samples.time
+    # Weight each sample by the time until the next one, ignoring pauses.
+    dt = np.zeros_like(t)
+    dt[:-1] = np.clip(np.diff(t), 0.0, MaxGap)
+    hr_ok = ~np.isnan(samples.hr) & (samples.hr > 0)
+    hr, hr_dt = samples.hr[hr_ok], dt[hr_ok]
+    hr_time = hr_dt.sum()
+
+    result = {
+        'duration': float(dt.sum()),
+        'trimp': 0.0,
+        'tss': 0.0,
+        'zones': [0.0] * (len(profile.bounds()) + 1),
+        'avg_hr': None,
+        'avg_cadence': None,
+        'decoupling': None,
+    }
+
+    cad_ok = ~np.isnan(samples.cadence) & (samples.cadence > 0)
+    if dt[cad_ok].sum() > 0:
+        result['avg_cadence'] = float(
+            np.average(samples.cadence[cad_ok], weights=dt[cad_ok]))
+
+    if hr_time <= 0:
+        return result
+
+    trimp = profile.trimp(profile.reserve(hr), hr_dt / 60.0).sum()
+    trimp_hour = profile.trimp(profile.reserve(profile.threshold), 60.0)
+    zones = np.searchsorted(profile.bounds(), hr, side='right')
+    result.update({
+        'trimp': float(trimp),
+        'tss': float(100.0 * trimp / trimp_hour),
+        'zones': np.bincount(
+            zones, weights=hr_dt, minlength=len(profile.bounds()) + 1).tolist(),
+        'avg_hr': float(np.average(hr, weights=hr_dt)),
+    })
+
+    # Aerobic decoupling, from samples with both heart rate and distance.
+    ok = hr_ok & ~np.isnan(samples.distance)
+    t, d, hr = t[ok], samples.distance[ok], samples.hr[ok]
+    if len(t) < 2 or t[-1] - t[0] < MinDecouplingTime:
+        return result
+    dt = np.clip(np.diff(t), 0.0, MaxGap)
+    meters = np.clip(np.diff(d), 0.0, None)
+    beats = hr[:-1] * dt / 60.0
+    first = t[:-1] < t[0] + (t[-1] - t[0]) / 2
+    second = ~first
+    if beats[first].sum() > 0 and beats[second].sum() > 0:
+        ef1 = meters[first].sum() / beats[first].sum()
+        ef2 = meters[second].sum() / beats[second].sum()
+        if ef1 > 0:
+            result['decoupling'] = float(100.0 * (ef1 - ef2) / ef1)
+    return result
+
+
+def fitness(loads: np.ndarray, atl_days: float = 7.0,
+            ctl_days: float = 42.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (ATL, CTL) given the total load of each consecutive day."""
+    # An exponentially weighted moving average is inherently sequential, but
+    # even decades of days take only milliseconds.
+    atl, ctl = np.zeros(len(loads)), np.zeros(len(loads))
+    a, c = 0.0, 0.0
+    for i, load in enumerate(loads.tolist()):
+        a += (load - a) / atl_days
+        c += (load - c) / ctl_days
+        atl[i], ctl[i] = a, c
+    return atl, ctl
+
+
+class TrainingIndex:
+    """Training load of each activity in a GarminStore, kept in the store."""
+
+    Filename = 'training.json'
+
+    def __init__(self, store: GarminStore):
+        self.store = store
+        try:
+            data = json.loads(store.read(self.Filename))
+        except KeyError:
+            data = {}
+        self.profile: Optional[Dict[str, Any]] = data.get('profile')
+        self.activities: Dict[str, Dict[str, Any]] = data.get('activities', {})
+        self.daily: List[Dict[str, Any]] = data.get('daily', [])
+
+    def save(self) -> None:
+        data = {
+            'profile': self.profile,
+            'activities': self.activities,
+            'daily': self.daily,
+        }
+        self.store.write(
+            self.Filename, json.dumps(data, sort_keys=True).encode('utf8'))
+
+    def update(self, profile: HeartRateProfile, processes=None,
+               until: Optional[date] = None) -> int:
+        """Bring the index up-to-date. Return #activities (re)computed.
+
+        Activities whose .tcx file has not changed are only recomputed if
+        the heart rate profile has changed (and never if the .tcx file has no
+        usable activity). New/changed .tcx files are parsed by a pool of
+        processes."""
+        rezone = profile.settings() != self.profile
+        todo: List[Tuple[Activity, float]] = []
+        seen = set()
+        for act in self.store.walk():
+            key = str(act.activityId)
+            tcx = act.path('tcx')
+            if not os.path.exists(tcx):
+                continue
+            seen.add(key)
+            mtime = os.path.getmtime(tcx)
+            entry = self.activities.get(key)
+            if (entry is not None and entry['tcx_mtime'] == mtime and
+                    (not rezone or 'tss' not in entry)):
+                continue
+            todo.append((act, mtime))
+
+        # Refresh trackpoint caches that are missing or older than the .tcx
+        stale = [act.path('tcx') for act, mtime in todo
+                 if not os.path.exists(act.path('samples')) or
+                 os.path.getmtime(act.path('samples')) < mtime]
+        if len(stale) > 1 and processes != 1:
+            with multiprocessing.Pool(processes) as pool:
+                pool.map(extract, stale, chunksize=16)
+        else:
+            for tcx in stale:
+                extract(tcx)
+
+        for act, mtime in todo:
+            key = str(act.activityId)
+            try:
+                samples = load_samples(act.path('samples'))
+            except IOError:  # No activity in .tcx file
+                self.activities[key] = {'tcx_mtime': mtime}
+                continue
+            entry = metrics(samples, profile)
+            entry.update({
+                'date': act.when.date().isoformat(),
+                'sport': act.what,
+                'tcx_mtime': mtime,
+            })
+            self.activities[key] = entry
+
+        for key in set(self.activities) - seen:
+            del self.activities[key]
+        self.profile = profile.settings()
+        self.daily = self.compute_daily(until)
+        self.save()
+        return len(todo)
+
+    def compute_daily(self, until: Optional[date] = None):
+        """Return daily load, ATL, CTL and TSB from first activity to until."""
+        entries = [e for e in self.activities.values() if 'tss' in e]
+        if not entries:
+            return []
+        dates = np.array([e['date'] for e in entries], dtype='datetime64[D]')
+        tss = np.array([e['tss'] for e in entries])
+        first = dates.min()
+        last = max(dates.max(), np.datetime64(until or date.today(), 'D'))
+        loads = np.bincount((dates - first).astype(int), weights=tss,
+                            minlength=int((last - first).astype(int)) + 1)
+        atl, ctl = fitness(loads)
+        days = np.arange(first, last + np.timedelta64(1, 'D'))
+        return [{
+            'date': str(day),
+            'load': round(load, 1),
+            'atl': round(a, 1),
+            'ctl': round(c, 1),
+            'tsb': round(c - a, 1),
+        } for day, load, a, c in zip(days, loads.tolist(), atl.tolist(),
+                                     ctl.tolist())]
+
+
+def parse_zones(s: str) -> Tuple[float, ...]:
+    """Parse comma-separated, ascending heart rate zone bounds."""
+    zones = tuple(float(z) for z in s.split(','))
+    if any(a >= b for a, b in zip(zones, zones[1:])):
+        raise ValueError('Zone bounds must be ascending: "{}"'.format(s))
+    return zones
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Garmin training load calculator')
+    parser.add_argument(
+        '-d', '--dir', default='.',
+        help='Directory where Garmin activities (.json/.tcx files) are stored.')
+    parser.add_argument(
+        '--rest-hr', type=float, help='Resting heart rate (bpm).')
+    parser.add_argument(
+        '--max-hr', type=float, help='Maximum heart rate (bpm).')
+    parser.add_argument(
+        '--threshold-hr', type=float,
+        help='Lactate threshold heart rate (bpm).')
+    parser.add_argument(
+        '--zones', type=parse_zones,
+        help='Comma-separated upper bounds of all but the last heart rate '
+             'zone (bpm). Default: 60,70,80,90%% of max heart rate.')
+    parser.add_argument(
+        '--female', action=argparse.BooleanOptionalAction, default=None,
+        help='Use the female (or, with --no-female, male) TRIMP weighting.')
+    parser.add_argument(
+        '-j', '--processes', type=int, default=None,
+        help='Number of processes parsing .tcx files (default: #CPUs).')
+    parser.add_argument(
+        '-n', '--days', type=int, default=14,
+        help='Show load, fatigue (ATL), fitness (CTL) and form (TSB) for '
+             'this many days (default: 14).')
+    args = parser.parse_args()
+
+    index = TrainingIndex(GarminStore(args.dir))
+    # Options not given on the command line are kept from the last run.
+    profile = HeartRateProfile.from_settings(index.profile or {})
+    for name, value in [('rest', args.rest_hr), ('max', args.max_hr),
+                        ('threshold', args.threshold_hr),
+                        ('zones', args.zones), ('female', args.female)]:
+        if value is not None:
+            setattr(profile, name, value)
+
+    print('Updated {} activities in {}'.format(
+        index.update(profile, args.processes), args.dir))
+    print('{:<10} {:>6} {:>6} {:>6} {:>6}'.format(
+        'date', 'load', 'ATL', 'CTL', 'TSB'))
+    for day in index.daily[-args.days:]:
+        print('{date:<10} {load:>6.1f} {atl:>6.1f} {ctl:>6.1f} {tsb:>6.1f}'
+              .format(**day))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Long-running alternative to download.py: keep one logged-in session per Garmin
+Connect account, and periodically download new activities into each account's
+GarminStore. Sessions are only re-authenticated when Garmin Connect rejects
+them, and failing accounts are retried with exponential backoff.
+
+A small JSON status report is served on http://localhost:<port>/ when the
+--port option is given. With --training and/or --aggregate, the training load
+(training.py) and statistics (aggregate.py) kept in each store are updated
+whenever new activities have been downloaded.
+"""
+
+from datetime import datetime
+import heapq
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import random
+import threading
+import time
+import traceback
+
+from download import (
+    GarminScraper, SessionExpired, add_policy_arguments, credentials_from_file,
+    credentials_from_prompt, policy_from_args, sync)
+from garmin import GarminStore
+
+
+class Account:
+    """One Garmin Connect account being watched, along with its status."""
+
+    def __init__(self, username, password, store):
+        self.username = username
+        self.password = password
+        self.store = store
+        self.remote = None  # GarminScraper; None until logged in
+        self.logins = 0
+        self.polls = 0
+        self.failures = 0  # Consecutive failed polls
+        self.downloaded = 0  # Activities new/changed since startup
+        self.last_poll = None
+        self.last_success = None
+        self.last_error = None
+        self.next_poll = None
+
+    def login(self):
+        remote = GarminScraper(self.username)
+        remote.login(self.password)
+        self.remote = remote  # Only once logged in
+        self.logins += 1
+
+    def status(self):
+        def fmt(t):
+            return None if t is None else datetime.fromtimestamp(t).isoformat()
+
+        return {
+            'store': self.store.basedir,
+            'logged_in': self.remote is not None,
+            'logins': self.logins,
+            'polls': self.polls,
+            'failures': self.failures,
+            'downloaded': self.downloaded,
+            'last_poll': fmt(self.last_poll),
+            'last_success': fmt(self.last_success),
+            'last_error': self.last_error,
+            'next_poll': fmt(self.next_poll),
+        }
+
+
+class Watcher:
+    """Poll a set of Accounts on a schedule.
+
+    Each account is polled every 'interval' seconds, +/- a random 'jitter'
+    fraction of the interval to avoid polling all accounts in lockstep. After
+    a failed poll, the delay is doubled for each consecutive failure, up to
+    'max_backoff' seconds.
+
+    Each poll is incremental: it stops after 'stop_after' consecutive
+    activities that are already in the store. New/changed activities are
+    passed to the 'on_new' callback as on_new(account, activities). If the
+    callback fails, the error is reported in the account's status, but the
+    poll still counts as successful.
+    """
+
+    def __init__(self, accounts, policy, interval=900, jitter=0.1,
+                 max_backoff=6 * 3600, stop_after=10, on_new=None):
+        self.accounts = accounts
+        self.policy = policy
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.stop_after = stop_after
+        self.on_new = on_new
+        self.started = time.time()
+        self.lock = threading.Lock()  # Protects Account status vs. status()
+
+    def delay(self, account):
+        """Return #seconds until the next poll of the given account."""
+        delay = self.interval * (2 ** min(account.failures, 16))
+        delay = min(delay, max(self.interval, self.max_backoff))
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll(self, account):
+        """Download new activities for account. Re-login at most once."""
+        for attempt in range(2):
+            if account.remote is None:
+                print('Logging in as {}...'.format(account.username))
+                account.login()
+            try:
+                return sync(account.remote, account.store, self.policy,
+                            stop_after=self.stop_after)
+            except SessionExpired:
+                print('Session for {} expired.'.format(account.username))
+                account.remote = None
+        raise SessionExpired(account.username)
+
+    def poll_and_reschedule(self, account):
+        now = time.time()
+        try:
+            changed = self.poll(account)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            # The session is kept unless Garmin Connect rejected it (see
+            # poll()); network errors don't call for a fresh login.
+            traceback.print_exc()
+            with self.lock:
+                account.failures += 1
+                account.last_error = '{}: {}'.format(type(e).__name__, e)
+        else:
+            with self.lock:
+                account.failures = 0
+                account.last_success = now
+                account.downloaded += len(changed)
+            if changed and self.on_new is not None:
+                try:
+                    self.on_new(account, changed)
+                except Exception as e:
+                    traceback.print_exc()
+                    with self.lock:
+                        account.last_error = 'on_new: {}: {}'.format(
+                            type(e).__name__, e)
+        with self.lock:
+            account.polls += 1
+            account.last_poll = now
+            account.next_poll = time.time() + self.delay(account)
+        return account.next_poll
+
+    def run(self):
+        """Poll accounts forever (or until interrupted)."""
+        queue = [(time.time(), i) for i in range(len(self.accounts))]
+        heapq.heapify(queue)
+        while queue:
+            when, i = heapq.heappop(queue)
+            time.sleep(max(0, when - time.time()))
+            account = self.accounts[i]
+            heapq.heappush(queue, (self.poll_and_reschedule(account), i))
+
+    def status(self):
+        with self.lock:
+            return {
+                'started': datetime.fromtimestamp(self.started).isoformat(),
+                'accounts': dict(
+                    (a.username, a.status()) for a in self.accounts),
+            }
+
+
+def serve_status(watcher, port, host='localhost'):
+    """Serve watcher.status() as JSON from a background thread."""
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/status'):
+                self.send_error(404)
+                return
+            body = json.dumps(
+                watcher.status(), indent=2, sort_keys=True).encode('utf8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Don't spam stderr with access logs
+
+    server = HTTPServer((host, port), StatusHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print('Serving status on http://{}:{}/'.format(host, port))
+    return server
+
+
+def print_new(account, activities):
+    for activity in activities:
+        print('New activity for {}: {}'.format(
+            account.username, activity['activityId']))
+
+
+def update_indexes(store, training=False, kinds=()):
+    """Bring the training load and/or aggregates in store up-to-date.
+
+    The training load uses the heart rate settings of the last training.py
+    run; the aggregates keep any bucket kinds they already had."""
+    # Imported here, so that watching without indexes does not load numpy.
+    if training:
+        from training import HeartRateProfile, TrainingIndex
+        index = TrainingIndex(store)
+        profile = HeartRateProfile.from_settings(index.profile or {})
+        print('Updated training load of {} activities in {}'.format(
+            index.update(profile), store.basedir))
+    if kinds:
+        from aggregate import Aggregator, stored_kinds
+        aggregator = Aggregator(store, list(kinds) + stored_kinds(store))
+        print('Updated aggregates of {} activities in {}'.format(
+            aggregator.update(), store.basedir))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Garmin Data Scraper (watch mode)',
+        epilog='Because the hell with cron jobs!')
+    parser.add_argument(
+        '-c', '--csv', required=False, type=argparse.FileType('r'),
+        help='CSV file with username/password pairs (comma separated).')
+    parser.add_argument(
+        '-o', '--output', required=False, default='.',
+        help='Output directory.')
+    parser.add_argument(
+        '-i', '--interval', type=float, default=900,
+        help='Seconds between polls of each account (default: 900).')
+    parser.add_argument(
+        '-j', '--jitter', type=float, default=0.1,
+        help='Randomize poll interval by this fraction (default: 0.1).')
+    parser.add_argument(
+        '--max-backoff', type=float, default=6 * 3600,
+        help='Max seconds between polls of a failing account.')
+    parser.add_argument(
+        '--stop-after', type=int, default=10,
+        help='Stop polling an account after this many consecutive known '
+             'activities (default: 10).')
+    parser.add_argument(
+        '--port', type=int, default=None,
+        help='Serve JSON status on this local port.')
+    parser.add_argument(
+        '--training', action='store_true',
+        help='Update the training load (see training.py) of each store '
+             'when new activities are downloaded.')
+    parser.add_argument(
+        '--aggregate', action='append', default=[], metavar='KIND',
+        help='Update the aggregates (see aggregate.py) of each store with '
+             'this bucket kind when new activities are downloaded. May be '
+             'given multiple times.')
+    add_policy_arguments(parser)
+    args = parser.parse_args()
+    policy = policy_from_args(parser, args)
+    if args.aggregate:
+        from aggregate import check_kind
+        try:
+            for kind in args.aggregate:
+                check_kind(kind)
+        except ValueError as e:
+            parser.error(str(e))
+
+    def on_new(account, activities):
+        print_new(account, activities)
+        update_indexes(account.store, args.training, args.aggregate)
+
+    if args.csv:
+        credentials = credentials_from_file(args.csv)
+    else:
+        credentials = credentials_from_prompt()
+
+    accounts = [
+        Account(username, password,
+                GarminStore(os.path.join(args.output, username)))
+        for username, password in credentials]
+    watcher = Watcher(accounts, policy, args.interval, args.jitter,
+                      args.max_backoff, args.stop_after, on_new=on_new)
+    if args.port is not None:
+        serve_status(watcher, args.port)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print('Interrupted. Exiting.')
+
+
+if __name__ == '__main__':
+    main()